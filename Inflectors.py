@@ -13,6 +13,8 @@
 # limitations under the License.
 # ************************************************************************
 
+from __future__ import annotations
+
 import os, sys
 ROOT = os.path.dirname(__file__)
 depth = 0
@@ -20,11 +22,18 @@ for _ in range(depth): ROOT = os.path.dirname(ROOT)
 sys.path.append(ROOT)
 
 # import required modules
+from contextlib import contextmanager
+from functools import lru_cache
 import json
 import os
 import re
-# import spaCy
-import spacy
+import threading
+# import spaCy (optional: the inflectors only read a few attributes of the tokens,
+# which Tools.TokenView provides as well)
+try:
+    import spacy
+except ImportError:
+    spacy = None
 
 # in DERBI we need a compound splitter; we use dtuggener/CharSplit.
 # to access it, we first need do some manipulations:
@@ -42,9 +51,9 @@ import spacy
 # filepath = os.path.join('CharSplit/charsplit', '__init__.py')
 # with open(filepath, 'w') as i:
 #     i.write('')
-    # finally import
-from CharSplit.charsplit.splitter import Splitter
-splitter = Splitter()
+    # finally import (in NOUNInflector: importing the splitter loads its n-gram model,
+    # so we only do it when the nouns are needed)
+# from CharSplit.charsplit.splitter import Splitter
 
 # import required scripts
 # from DERBI import Tools
@@ -69,42 +78,72 @@ class BasicInflector:
 
     def __init__(self, fa_path: str=None, lexc_path: str=None):
         self.auto_rules, self.lexc_rules = None, None
-        # obtain rules
+        # obtain rules (shared with the other inflectors using the same files)
         if fa_path is not None:
-            self.auto_rules = Tools.StateMachine(fa_path).rules
+            self.auto_rules = Tools.load_rules(Tools.StateMachine, fa_path)
+            # the applicable rules for each tagset (see Tools.RuleChains)
+            self.auto_chains = Tools.load_chains(fa_path)
         if lexc_path is not None:
-            self.lexc_rules = Tools.Lexicon(lexc_path).rules
+            self.lexc_rules = Tools.load_rules(Tools.Lexicon, lexc_path)
+        # for the stats (see Tools.Stats)
+        self.lexc_name = os.path.basename(lexc_path) if lexc_path is not None else None
+        self.fa_path, self.lexc_path = fa_path, lexc_path
+
+    # the inflectors are shared by the process (see load_inflector), 
+    # so an inflector is pickled as the arguments it is loaded with
+    def __reduce__(self) -> tuple:
+        return load_inflector, (type(self).__name__, self.fa_path, self.lexc_path)
 
-    def search_in_lexicon(self, lemma: str, target_tags: str) -> tuple:
+    def search_in_lexicon(self, lemma: str, target_tags: Tools.TagSet) -> tuple:
         if (self.lexc_rules is None) or (self.lexc_rules.get(lemma) is None):
-            return lemma, Tools.split_tags(target_tags)
+            if Tools.stats.enabled:
+                Tools.stats.count('lexicon', str(self.lexc_name), 'misses')
+            return lemma, target_tags.as_dict()
         else:
-            tags_dict = Tools.split_tags(target_tags)
+            # the tags are checked as bitmasks (see Tools.compile_conditions):
+            # we require partial match, i.e. none of the target features
+            # can be of the category the rule conditions but not accepted by it
+            tags_mask, unknown_tags = target_tags.mask, target_tags.unknown
             curr_rules = self.lexc_rules[lemma]
             for rule in curr_rules:
-                # we require partial match
-                rule_is_applicable = set([((rule['rule'].get(cat) is None) or (feat in rule['rule'][cat])) 
-                                      for cat, feat in tags_dict.items()]) == {True}
-                if rule_is_applicable:
-                    # we return output and the not matched features (for further inflection) as well  
-                    return rule['output'], {cat: feat for cat, feat in tags_dict.items() if rule['rule'].get(cat) is None}
+                if tags_mask & rule['excluded']:
+                    continue
+                # the features that are not valid can only be checked explicitly
+                if len(unknown_tags) and not all([(rule['rule'].get(cat) is None) or (feat in rule['rule'][cat]) 
+                                                  for cat, feat in unknown_tags.items()]):
+                    continue
+                # we return output and the not matched features (for further inflection) as well  
+                remaining_tags = Tools.decode_tags(tags_mask & ~rule['cats'])
+                remaining_tags.update({cat: feat for cat, feat in unknown_tags.items() if rule['rule'].get(cat) is None})
+                if Tools.stats.enabled:
+                    Tools.stats.count('lexicon', self.lexc_name, 'hits')
+                return rule['output'], remaining_tags
             else:
-                return lemma, Tools.split_tags(target_tags)
+                # the lemma is in the lexicon, but none of its rules is applicable
+                if Tools.stats.enabled:
+                    Tools.stats.count('lexicon', self.lexc_name, 'misses')
+                return lemma, target_tags.as_dict()
 
     def automata(self, token: str, tags_dict: dict) -> str:
         if self.auto_rules is None:
             return token
+        memo = getattr(shared, 'automata', None)
+        if memo is None:
+            return self.auto_chains(token, tags_dict)
+        # the results are shared (see shared_results): 
+        # the tagsets that have the same chain share the output
+        key = (id(self.auto_chains), token) + tuple([tags_dict.get(cat, '') for cat in self.auto_chains.cats])
+        output = memo.get(key)
+        if output is None:
+            output = memo[key] = self.auto_chains(token, tags_dict)
+        return output
 
-        for rule in self.auto_rules:
-            # here we require full match though
-            rule_is_applicable = (set([tags_dict.get(cat, '') in rule['rule'][cat]  
-                                  for cat, feat in rule['rule'].items()]) == {True}) or (rule['rule'] == {})
-            if rule_is_applicable:
-                token = re.sub(rule['pattern'], rule['to_sub'], token)
-            # print(rule, token)
-        return token
+    # the output of an inflector depends only on a few attributes of the token;
+    # they make (together with the target tags) the key of the inflection cache
+    def cache_key(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> tuple:
+        return token.lemma_, target_tags
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         # the common way:
             # 1. search in lexicon
         output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
@@ -123,6 +162,9 @@ class Uninflected(BasicInflector):
     def automata(self, *args):
         pass
 
+    def cache_key(self, token: spacy.tokens.token.Token, _) -> tuple:
+        return token.norm_,
+
     # drop tags
     def __call__(self, token: spacy.tokens.token.Token, _):
         return token.norm_
@@ -143,28 +185,38 @@ class ADJInflector(BasicInflector):
         # if not applicable, there is no umlaut
         return token.replace('#', '')
 
-    def __call__(self, token: spacy.tokens.token.Token or str, target_tags: str) -> str:
+    # fix the lemmas spaCy predicts incorrectly
+    def restore_lemma(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
+        lemma = token.lemma_
+        # somehow for ADV and ADJ spacy add 'en' to lemma in Degree=Pos,
+        # e.g. 'schnell'.lemma_ = 'schnellen' but 'schneller'.lemma_ = 'schnell'
+        if (token.pos_ == 'ADV') and (token.text.lower() + 'en' == lemma):
+            lemma = token.text
+        # somehow for ADV spacy add 'e'/'en'/... to lemma in some forms,
+        # e.g. 'rote'.lemma_ = 'rote' but 'roten'.lemma_ = 'rot' 
+        if (token.pos_ == 'ADJ') and (token.text.lower() == lemma) and (len(target_tags) > 1):
+            lemma = re.sub('e[mnrs]{0,1}$', '', lemma)
+        return lemma
+
+    def cache_key(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> tuple:
+        return self.restore_lemma(token, target_tags).lower(), target_tags
+
+    # inflect the (already restored) lemma
+    def inflect_lemma(self, lemma: str, target_tags: Tools.TagSet) -> str:
+        output, remaining_tags = self.search_in_lexicon(lemma.lower(), target_tags)
+        if not(len(remaining_tags)):
+            return output
+        # toss an umlaut, if applicable
+        return self.umlaut(self.automata(output, remaining_tags))
+
+    def __call__(self, token: spacy.tokens.token.Token or str, target_tags: Tools.TagSet) -> str:
         # from AUX and VERB we can receive <str> tokens
         # (when Verbform=Part),
         # so we must just pass the following part then
         if not isinstance(token, str):
-            # somehow for ADV and ADJ spacy add 'en' to lemma in Degree=Pos,
-            # e.g. 'schnell'.lemma_ = 'schnellen' but 'schneller'.lemma_ = 'schnell'
-            if (token.pos_ == 'ADV') and (token.text.lower() + 'en' == token.lemma_):
-                token.lemma_ = token.text
-            # somehow for ADV spacy add 'e'/'en'/... to lemma in some forms,
-            # e.g. 'rote'.lemma_ = 'rote' but 'roten'.lemma_ = 'rot' 
-            if (token.pos_ == 'ADJ') and (token.text.lower() == token.lemma_) and (len(Tools.split_tags(target_tags)) > 1):
-                token.lemma_ = re.sub('e[mnrs]{0,1}$', '', token.lemma_)
-
-            output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
-            if not(len(remaining_tags)):
-                return output
-        else:
-            output = token
-            remaining_tags = Tools.split_tags(target_tags)
+            return self.inflect_lemma(self.restore_lemma(token, target_tags), target_tags)
             
-        auto_output = self.automata(output, remaining_tags)
+        auto_output = self.automata(token, target_tags.as_dict())
         # toss an umlaut, if applicable
         return self.umlaut(auto_output)
 
@@ -175,7 +227,7 @@ class ADPInflector(BasicInflector):
     def automata(self, *args):
         pass
     
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
         if not(len(remaining_tags)):
             return output
@@ -184,8 +236,7 @@ class ADPInflector(BasicInflector):
         # remaining tags, it means it's not there (as APD.lexc defines 
         # all the features); then we're trying to inflect the adp to 
         # a form it can't have
-        raise ValueError('Features "' + target_tags + 
-                            '" are not available for word "' + token.norm_ + '".')
+        raise Tools.InflectionError(Tools.Status.UNAVAILABLE_FOR_WORD, target_tags.string, token.norm_)
 
 
 # AUX
@@ -194,7 +245,7 @@ class AUXInflector(BasicInflector):
     def __init__(self, fa_path: str=None, lexc_path: str=None):
         super().__init__(fa_path, lexc_path)
         # ADJInflector for participles
-        self.adj_inflector = ADJInflector('./meta/automata/ADJ.fa')
+        self.adj_inflector = load_inflector('ADJInflector', './meta/automata/ADJ.fa')
 
     # strong german verbs toss an umlaut
     # when Mood=Sub, 
@@ -209,19 +260,18 @@ class AUXInflector(BasicInflector):
         sub_stem = re.sub('u', 'ü', sub_stem)
         return re.sub('^' + past_stem + '&', sub_stem, token)
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str):
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet):
         # restrict imperative forms formation for modal verbs
         if ((token.lemma_.lower() in ['dürfen', 'können', 'mögen', 'müssen', 'sollen', 'wollen'])
-                                                                and ('Mood=Imp' in target_tags)):
-            raise ValueError('No Imperative forms available for modal verbs.')
+                                                                and (target_tags.get('Mood') == 'Imp')):
+            raise Tools.InflectionError(Tools.Status.MODAL_IMPERATIVE)
             
-        if token.lemma_ == 'habe':
-            token.lemma_ = 'haben'
+        lemma = 'haben' if token.lemma_ == 'habe' else token.lemma_
             
-        if 'Verbform=Part' in target_tags:
-            target_tags = re.sub('Verbform=Part', 'Tense=Past|Verbform=Part', target_tags)      
+        if (target_tags.get('Verbform') == 'Part') and ('Tense' not in target_tags):
+            target_tags = target_tags.update({'Tense': 'Past'})
 
-        output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
+        output, remaining_tags = self.search_in_lexicon(lemma.lower(), target_tags)
         if not(len(remaining_tags)):
             return output
 
@@ -231,8 +281,8 @@ class AUXInflector(BasicInflector):
 
         # use ADJInflector for participles,
         # as they inflect the same way
-        if 'Verbform=Part' in target_tags:
-            return self.adj_inflector(output, re.sub('Tense=Past\|', '', target_tags) + '|Degree=Pos')
+        if target_tags.get('Verbform') == 'Part':
+            return self.adj_inflector(output, target_tags.without('Tense').update({'Degree': 'Pos'}))
         
         return output
 
@@ -254,13 +304,19 @@ class DETInflector(BasicInflector):
 
         return match
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
+    # detect possessive pronouns
+    def lexicon_input(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
+        return token.lemma_.lower() if target_tags.get('Poss') != 'Yes' else self.parse_poss_dets(token.text.lower())
+
+    def cache_key(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> tuple:
+        return token.lemma_.lower(), self.lexicon_input(token, target_tags), target_tags
+
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         # restrict plural forms formations for 'ein'
-        if (re.search('^ein(e[mnrs]{0,1}){0,1}', token.lemma_.lower()) is not None) and ('Number=Plur' in target_tags):
-            raise ValueError('Article "ein" has only Singular forms.')
+        if (re.search('^ein(e[mnrs]{0,1}){0,1}', token.lemma_.lower()) is not None) and (target_tags.get('Number') == 'Plur'):
+            raise Tools.InflectionError(Tools.Status.EIN_PLURAL)
         
-        # detect possessive pronouns
-        input = token.lemma_.lower() if 'Poss=Yes' not in target_tags else self.parse_poss_dets(token.text.lower())
+        input = self.lexicon_input(token, target_tags)
 
         output, remaining_tags = self.search_in_lexicon(input, target_tags)
         if not(len(remaining_tags)):
@@ -275,15 +331,29 @@ class NOUNInflector(BasicInflector):
     def __init__(self, fa_path: str=None, lexc_path: str=None):
         super().__init__(fa_path, lexc_path)
         # ADJInflector for nouns of adjective declination
-        self.adj_inflector = ADJInflector('./meta/automata/ADJ.fa')
-
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:        
+        self.adj_inflector = load_inflector('ADJInflector', './meta/automata/ADJ.fa')
+        # compound splitter (see above)
+        from CharSplit.charsplit.splitter import Splitter
+        self.splitter = Splitter()
+        # the splits do not depend on the tags
+        self.split_compound = lru_cache(maxsize=4096)(self.run_splitter)
+
+    def run_splitter(self, word: str) -> list:
+        Tools.stats.count('charsplit', 'calls')
+        return self.splitter.split_compound(word)
+
+    def cache_key(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> tuple:
+        # for adjective declination nouns the form of the token matters as well
+        if 'Declination' in target_tags:
+            return token.lemma_.lower(), target_tags, re.search('e[mnrs]{0,1}$', token.norm_) is not None
+        return token.lemma_.lower(), target_tags
+
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:        
         # adjective declination nouns
-        if 'Declination=' in target_tags:
+        if 'Declination' in target_tags:
             if re.search('e[mnrs]{0,1}$', token.norm_) is None:
-                raise ValueError('Could not decline word "' + token.norm_ + '" as an ADJ.')
-            token.lemma_ = re.sub('e[mnrs]{0,1}$', '', token.lemma_.lower())
-            return self.adj_inflector(token, target_tags + '|Degree=Pos')
+                raise Tools.InflectionError(Tools.Status.ADJ_DECLINATION, token.norm_)
+            return self.adj_inflector.inflect_lemma(re.sub('e[mnrs]{0,1}$', '', token.lemma_.lower()), target_tags.update({'Degree': 'Pos'}))
 
         # primary search in lexicon      
         output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
@@ -291,7 +361,7 @@ class NOUNInflector(BasicInflector):
             return output
 
         # if fails, we'll try to split it and search once again
-        splitted = splitter.split_compound(output)[0]
+        splitted = self.split_compound(output)[0]
         # it's no compound then
         if splitted[0] == 0:
             return self.automata(output, remaining_tags)
@@ -309,19 +379,18 @@ class NOUNInflector(BasicInflector):
 # PRON
 class PRONInflector(BasicInflector):
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         # we need it for the state machine not to be confused,
         # as every reflexive pronoun has tag 'Reflex=Yes' and PronType=Prs;
         # we need only Reflex=Yes
-        if 'Reflex=Yes' in target_tags:
-            target_tags = target_tags.replace('Prontype=Prs|', '')
+        if (target_tags.get('Reflex') == 'Yes') and (target_tags.get('Prontype') == 'Prs'):
+            target_tags = target_tags.without('Prontype')
 
         # assert lemma 'ich' for personal pronouns
         # (for some reason lemmas for them vary)
-        if 'Prontype=Prs' in target_tags:
-            token.lemma_ = 'ich'
+        lemma = 'ich' if target_tags.get('Prontype') == 'Prs' else token.lemma_
 
-        output, remaining_tags = self.search_in_lexicon(token.lemma_.lower(), target_tags)
+        output, remaining_tags = self.search_in_lexicon(lemma.lower(), target_tags)
         if not(len(remaining_tags)):
             return output
         
@@ -334,8 +403,8 @@ class PROPNInflector(BasicInflector):
     def search_in_lexicon(self, *args):
         pass
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
-        tags_dict = Tools.split_tags(target_tags)
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
+        tags_dict = target_tags.as_dict()
         return self.automata(token.lemma_.lower(), tags_dict)
 
 
@@ -345,49 +414,93 @@ class VERBInflector(AUXInflector):
     def __init__(self, fa_path: str=None, lexc_path: str=None):
         super().__init__(fa_path, lexc_path)
         # we need to distinct between separable and inseparable prefixes
-        with open('./meta/lexicons/verb_prefixes.json') as j:
+        with open(Tools.package_path('./meta/lexicons/verb_prefixes.json')) as j:
             self.prefixes = json.load(j)
+        # all the prefixes in one trie (see match_prefix)
+        self.prefix_list = self.prefixes['sep'] + self.prefixes['insep']
+        self.insep_prefixes = set(self.prefixes['insep'])
+        self.prefix_trie = self.build_trie(self.prefix_list)
+        # the prefixes do not depend on the tags
+        self.split_prefixes = lru_cache(maxsize=4096)(self.split_prefixes)
+        # the lemmas of the lexicons are segmented in advance
+        self.segmented = {}
+        for rules in [self.lexc_rules, Tools.load_rules(Tools.Lexicon, './meta/lexicons/AUX.lexc')]:
+            for lemma in (rules or {}):
+                self.segmented[lemma] = self.split_prefixes(lemma)
+
+    # the stem without the flexion
+    flexion_pattern = re.compile('(en$|(?<=[lr])n$|(?<=tu)n$|(?<=sei)n$)')
+    # the diphthongs are substituted with one-symbol characters
+    # to know exactly the count of syllables (for the function
+    # not to separate the prefix leaving 'syllableless' stem)
+    dis = {
+        'ei': 'E',
+        'ie': 'I',
+        'eu': 'U',
+        'äu': 'Y'
+    }
+    di_pattern = re.compile('(ei|ie|eu|äu)')
+    restore_dis = str.maketrans({v: k for k, v in dis.items()})
+    syllable_pattern = re.compile('[aeiouyäöüEIUY]')
+
+    # prefix trie: nested dicts of characters; 
+    # the key None of a node marks the end of a prefix and keeps its position in the list
+    @staticmethod
+    def build_trie(prefixes: list) -> dict:
+        trie = {}
+        for i, prefix in enumerate(prefixes):
+            node = trie
+            for char in prefix:
+                node = node.setdefault(char, {})
+            node.setdefault(None, i)
+        return trie
+
+    # the prefix the stem starts with or None; if several match, 
+    # the first one in the list is taken (as by an alternation of the prefixes)
+    def match_prefix(self, stem: str) -> str or None:
+        node, first = self.prefix_trie, None
+        for char in stem:
+            node = node.get(char)
+            if node is None:
+                break
+            i = node.get(None)
+            if (i is not None) and ((first is None) or (i < first)):
+                first = i
+        return self.prefix_list[first] if first is not None else None
 
     # split a verb into prefixes and non-prefix-part
-    def sep_prefixes(self, token: str) -> str:
+    def sep_prefixes(self, token: str) -> tuple:
+        segmented = self.segmented.get(token)
+        return segmented if segmented is not None else self.split_prefixes(token)
+
+    def split_prefixes(self, token: str) -> tuple:
         # first we have to separate the flexion
-        stem = re.sub('(en$|(?<=[lr])n$|(?<=tu)n$|(?<=sei)n$)', '', token)
-        # second we want to substitude all the diphthongs with one-symbol characters
-        # to know exactly the count of syllables (for the function
-        # not to separate the prefix leaving 'syllableless' stem)
-        dis = {
-            'ei': 'E',
-            'ie': 'I',
-            'eu': 'U',
-            'äu': 'Y'
-        }
-        di_pattern = re.compile('(ei|ie|eu|äu)')
-        while di_pattern.search(stem) is not None:
-            di = di_pattern.search(stem)[0]
-            stem = re.sub(di, dis[di], stem)
-
-        syls = lambda x: len(re.findall('[aeiouyäöüEIUY]', x))
-        
+        stem = self.flexion_pattern.sub('', token)
+        # second we substitute the diphthongs: each one in the order they are found
+        di = self.di_pattern.search(stem)
+        while di is not None:
+            stem = stem.replace(di[0], self.dis[di[0]])
+            di = self.di_pattern.search(stem)
+
         prefs = []
         # detect and separate prefixes
-        prefixes_pattern = re.compile('^' + '|^'.join(self.prefixes['sep'] + self.prefixes['insep']))
-        while prefixes_pattern.search(stem) is not None:
-            pref = prefixes_pattern.search(stem)[0]
-            if syls(re.sub(pref, '', stem)) == 0:
+        pref = self.match_prefix(stem)
+        while pref is not None:
+            # (all the occurrences of the prefix are left out for the check)
+            if not self.syllable_pattern.search(stem.replace(pref, '')):
                 break
             prefs.append(pref)
-            stem = re.sub(pref, '', stem, count=1)
+            stem = stem[len(pref):]
+            pref = self.match_prefix(stem)
 
         if not len(prefs):
             return ('', False, token)
         
-        # restore diphthongs
-        restore_dis = lambda x, matches: x if not len(matches) else restore_dis(re.sub(matches[-1], 
-                                    {v: k for k, v in dis.items()}[matches[-1]], x), matches[:-1])
         # we also need to know if the prefix complex is separable or inseparable
-        insep = ((prefs[0] in self.prefixes['insep']) or (prefs[-1] in self.prefixes['insep']))
-        prefs = restore_dis(''.join(prefs), re.findall('|'.join({v: k for k, v in dis.items()}.keys()), ''.join(prefs)))
-        return prefs, insep, re.sub('^' + prefs, '', token)
+        insep = ((prefs[0] in self.insep_prefixes) or (prefs[-1] in self.insep_prefixes))
+        # restore diphthongs
+        prefs = ''.join(prefs).translate(self.restore_dis)
+        return prefs, insep, token[len(prefs):] if token.startswith(prefs) else token
 
     # restore separated prefixes
     def add_prefixes(self, prefixes: str, insep: bool, token: str, part: bool) -> str:
@@ -402,25 +515,24 @@ class VERBInflector(AUXInflector):
         # separable prefixes are separated in finite and imperative forms
         return '(' + token + ' , ' + prefixes + ') '
 
-    def __call__(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
+    def __call__(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         # restrict imperative forms formation for modal verbs
         if ((token.lemma_.lower() in ['dürfen', 'können', 'mögen', 'müssen', 'sollen', 'wollen'])
-                                                                and ('Mood=Imp' in target_tags)):
-            raise ValueError('No Imperative forms available for modal verbs.')
+                                                                and (target_tags.get('Mood') == 'Imp')):
+            raise Tools.InflectionError(Tools.Status.MODAL_IMPERATIVE)
         
-        if token.lemma_ == 'habe':
-            token.lemma_ = 'haben'
+        lemma = 'haben' if token.lemma_ == 'habe' else token.lemma_
             
         if target_tags == 'Verbform=Inf':
-            return token.lemma_
+            return lemma
         
         part = False
         if target_tags == 'Verbform=Part':
             part = True
-            target_tags = 'Tense=Past|Verbform=Part'
+            target_tags = Tools.TagSet.of('Tense=Past|Verbform=Part')
         
         # separate prefixes
-        prefixes, insep, stem = self.sep_prefixes(token.lemma_.lower())
+        prefixes, insep, stem = self.sep_prefixes(lemma.lower())
 
         # NB! in lexicon we search only non-prefix part
         output, remaining_tags = self.search_in_lexicon(stem, target_tags)
@@ -437,7 +549,38 @@ class VERBInflector(AUXInflector):
 
         # use ADJInflector for participles,
         # as they inflect the same way
-        if 'Verbform=Part' in target_tags:
-            return self.adj_inflector(output, re.sub('Tense=Past\|', '', target_tags) + '|Degree=Pos')
+        if target_tags.get('Verbform') == 'Part':
+            return self.adj_inflector(output, target_tags.without('Tense').update({'Degree': 'Pos'}))
         
         return output
+
+
+# intermediate results shared by the forms of one paradigm (see DERBI.paradigm);
+# they are kept per thread, as the inflectors are shared by the threads
+shared = threading.local()
+
+@contextmanager
+def shared_results():
+    shared.automata = {}
+    try:
+        yield
+    finally:
+        shared.automata = None
+
+
+# inflectors are shared by all the DERBI instances of the process
+# (they keep no state but the rules); each one is created 
+# when it is needed for the first time
+loaded_inflectors = {}
+# inflectors can create other inflectors (e.g. VERBInflector creates ADJInflector)
+inflectors_lock = threading.RLock()
+
+def load_inflector(inflector_name: str, fa_path: str=None, lexc_path: str=None) -> BasicInflector:
+    key = (inflector_name, fa_path, lexc_path)
+    inflector = loaded_inflectors.get(key)
+    if inflector is None:
+        with inflectors_lock:
+            inflector = loaded_inflectors.get(key)
+            if inflector is None:
+                inflector = loaded_inflectors[key] = globals()[inflector_name](fa_path, lexc_path)
+    return inflector
@@ -13,20 +13,42 @@
 # limitations under the License.
 # ************************************************************************
 
+from __future__ import annotations
 # import required modules / functions
-from numpy import argmin
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
+from contextlib import nullcontext
+from enum import IntEnum
+from functools import lru_cache
+from time import perf_counter, time
+import hashlib
 import json
+import mmap
+import os
+import pickle
 import re
+import struct
+import threading
 import warnings
-# import spaCy
-import spacy
+# import spaCy; it is only needed to parse texts:
+# without it, words can still be inflected from their analyses (see TokenView)
+try:
+    import spacy
+    import spacy.lang.de
+except ImportError:
+    spacy = None
+
+# data files are located relative to the package, not to the working directory
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# resolve a relative data path like './meta/automata/ADJ.fa' against the package
+def package_path(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.normpath(os.path.join(ROOT, path))
 
 # obtain required json data
-with open('./meta/LabelsScheme.json') as json_file:
+with open(package_path('./meta/LabelsScheme.json')) as json_file:
     LabelsScheme = json.load(json_file)
     
-with open('./meta/ValidFeatures.json') as json_file:
+with open(package_path('./meta/ValidFeatures.json')) as json_file:
     ValidFeatures = json.load(json_file)
 
 # json data links
@@ -45,55 +67,375 @@ def split_tags(tags: str) -> dict:
 def merge_tags(tags: dict) -> str:
     return '|'.join([cat + '=' + feat for cat, feat in tags.items()])
 
+# each valid category-feature pair gets its own bit, so that a tagset 
+# can be represented as an integer bitmask, for example,
+# 'Case=Nom|Number=Plur' -> FeatureBits[('Case', 'Nom')] | FeatureBits[('Number', 'Plur')]
+FeatureBits = {}
+for cat, feats in ValidFeatures.items():
+    for feat in feats:
+        FeatureBits[(cat, feat)] = 1 << len(FeatureBits)
+# all the bits of a category
+CategoryBits = {cat: sum(FeatureBits[(cat, feat)] for feat in feats) for cat, feats in ValidFeatures.items()}
+
+# bitmask (see TagSet) -> dict
+@lru_cache(maxsize=None)
+def _decode_tags(mask: int) -> tuple:
+    return tuple(pair for pair, bit in FeatureBits.items() if mask & bit)
+
+def decode_tags(mask: int) -> dict:
+    return dict(_decode_tags(mask))
+
+# compile the conditions of a rule (see below) to two bitmasks:
+# the bits of all the categories the rule conditions and
+# the bits of the features of these categories the rule does not accept
+def compile_conditions(rule: dict) -> tuple:
+    cats_mask, feats_mask = 0, 0
+    for cat, feats in rule.items():
+        cats_mask |= CategoryBits.get(cat, 0)
+        for feat in feats:
+            feats_mask |= FeatureBits.get((cat, feat), 0)
+    return cats_mask, cats_mask & ~feats_mask
+
+
+# immutable hashable tagset that is passed through the pipeline instead of 
+# 'Name=Value' strings: the category-feature pairs (sorted by category), 
+# the string and the bitmask are computed once; TagSet.of() interns
+# the instances, so that the same tagsets are usually the same objects;
+# a TagSet equals (and hashes as) its string, so it can be compared to strings
+# and used interchangeably with them as a (cache) key
+class TagSet:
+
+    __slots__ = ('pairs', 'string', 'mask', 'unknown')
+
+    def __init__(self, pairs: tuple):
+        self.pairs = pairs
+        self.string = merge_tags(dict(pairs))
+        # the pairs that are not in ValidFeatures cannot be encoded, so they are kept separately
+        self.mask, self.unknown = 0, {}
+        for cat, feat in pairs:
+            bit = FeatureBits.get((cat, feat))
+            if bit is None:
+                self.unknown[cat] = feat
+            else:
+                self.mask |= bit
+
+    @staticmethod
+    def of(tags) -> 'TagSet':
+        if isinstance(tags, TagSet):
+            return tags
+        if isinstance(tags, dict):
+            return intern_tagset(tuple(sorted(tags.items())))
+        return parse_tagset(tags)
+
+    def __str__(self) -> str:
+        return self.string
+
+    def __repr__(self) -> str:
+        return 'TagSet(' + repr(self.string) + ')'
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, TagSet):
+            return self.string == other.string
+        return self.string == other
+
+    def __hash__(self) -> int:
+        return hash(self.string)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    # the categories
+    def __iter__(self):
+        return (cat for cat, _ in self.pairs)
+
+    def __contains__(self, cat: str) -> bool:
+        return any(c == cat for c, _ in self.pairs)
+
+    def get(self, cat: str, default=None):
+        for c, feat in self.pairs:
+            if c == cat:
+                return feat
+        return default
+
+    def items(self) -> tuple:
+        return self.pairs
+
+    def as_dict(self) -> dict:
+        return dict(self.pairs)
+
+    # the tagset without the given categories
+    def without(self, *cats) -> 'TagSet':
+        return TagSet.of({cat: feat for cat, feat in self.pairs if cat not in cats})
+
+    # the tagset with the given features added (or replaced)
+    def update(self, tags: dict) -> 'TagSet':
+        return TagSet.of({**dict(self.pairs), **tags})
+
+@lru_cache(maxsize=65536)
+def intern_tagset(pairs: tuple) -> TagSet:
+    return TagSet(pairs)
+
+@lru_cache(maxsize=65536)
+def parse_tagset(tags: str) -> TagSet:
+    return intern_tagset(tuple(sorted(split_tags(tags).items())))
+
+
+# status codes of the inflection results (see Result);
+# the codes below 10 are successes
+class Status(IntEnum):
+    OK = 0                      # inflected
+    UNCHANGED = 1               # the target features are the ones the token already has
+    DEFAULTS = 2                # inflected; some features were not provided and were set as default
+    SKIPPED_CHARACTERS = 3      # the word contains invalid characters and was not processed
+    SKIPPED_NO_TAGS = 4         # no tags were provided for the word, it was not inflected
+    NO_TAGS = 5                 # no tags were provided for the text, nothing was inflected
+    INVALID_CATEGORY = 10
+    INVALID_FEATURE = 11
+    FIXED_CATEGORY = 12         # the category cannot be alternated for the POS
+    UNSUPPORTED_FOR_POS = 13
+    UNSUPPORTED_FOR_WORD = 14
+    UNAVAILABLE_FOR_WORD = 15   # the lexicon has no such form of the word
+    MODAL_IMPERATIVE = 16
+    EIN_PLURAL = 17
+    ADJ_DECLINATION = 18
+    ARGS_MISMATCH = 20          # numbers of the tagsets and the indices differ
+    INDEX_OUT_OF_RANGE = 21
+    BAD_REQUEST = 22
+    ERROR = 30                  # any other exception
+
+# the messages are only built when they are asked for (see status_message)
+status_messages = {
+    Status.OK: 'OK',
+    Status.UNCHANGED: 'The word already has the target features.',
+    Status.DEFAULTS: 'Provided tags were not found in labels scheme. Some features were set as default.\nResult features are "{0}". ' + 
+                     'You can specify desired features if you wish.\nLabels scheme is available at: ' + labels_scheme_link + '.',
+    Status.SKIPPED_CHARACTERS: 'Word "{0}" contains invalid characters. It will not be processed.',
+    Status.SKIPPED_NO_TAGS: 'No tags for word "{0}" were provided; it will not be inflected.',
+    Status.NO_TAGS: 'No tags were provided; none of the tokens will be inflected.',
+    Status.INVALID_CATEGORY: 'Category "{0}" is not supported.\nValid categories are available at ' + valid_features_link + '.',
+    Status.INVALID_FEATURE: 'Feature "{0}" is not valid for category "{1}".\nValid features are available at ' + valid_features_link + '.',
+    Status.FIXED_CATEGORY: 'Category "{0}" cannot be alternated for POS "{1}".',
+    Status.UNSUPPORTED_FOR_POS: 'Features "{0}" are not supported for POS "{1}".\nLabels scheme is available at: ' + labels_scheme_link + '.',
+    Status.UNSUPPORTED_FOR_WORD: 'Features "{0}" are not supported for word "{1}" of POS "{2}".\nLabels scheme is available at: ' + 
+                                 labels_scheme_link + '.',
+    Status.UNAVAILABLE_FOR_WORD: 'Features "{0}" are not available for word "{1}".',
+    Status.MODAL_IMPERATIVE: 'No Imperative forms available for modal verbs.',
+    Status.EIN_PLURAL: 'Article "ein" has only Singular forms.',
+    Status.ADJ_DECLINATION: 'Could not decline word "{0}" as an ADJ.',
+    Status.ARGS_MISMATCH: 'Number of indices and number of target tagsets must not differ.',
+    Status.INDEX_OUT_OF_RANGE: 'Index {0} is out of range for a text of {1} tokens.',
+    Status.BAD_REQUEST: '{0}',
+    Status.ERROR: '{0}'
+}
+
+def status_message(status: Status, detail: tuple=()) -> str:
+    return status_messages[status].format(*detail)
+
+# the errors of the inflectors (e.g. the imperative of a modal verb) carry their status;
+# the message is built only when the error is printed
+class InflectionError(ValueError):
+
+    def __init__(self, status: Status, *detail):
+        super().__init__(status, *detail)
+        self.status, self.detail = status, detail
+
+    def __str__(self) -> str:
+        return status_message(self.status, self.detail)
+
+
+# structured result of an inflection (see DERBI.__call__ with structured=True);
+# of a token: the status, the form (None if it failed), the resolved target tagset 
+# and the features that were set as default;
+# of a text: the status (OK or the status of the first token that failed), 
+# the text with all the tokens that could be inflected (partial success) 
+# and the results of the tokens by index;
+# detail holds the values of the message (see status_message), which is only built when asked for
+class Result:
+
+    __slots__ = ('status', 'result', 'target_tags', 'defaults', 'detail', 'tokens')
+
+    def __init__(self, status: Status, result: str=None, target_tags: TagSet=None, defaults: dict=None, 
+                 detail: tuple=(), tokens: dict=None):
+        self.status = status
+        self.result = result
+        self.target_tags = target_tags
+        self.defaults = defaults
+        self.detail = detail
+        self.tokens = tokens
+
+    @staticmethod
+    def from_exception(e: Exception) -> 'Result':
+        if isinstance(e, InflectionError):
+            return Result(e.status, detail=e.detail)
+        return Result(Status.ERROR, detail=(e,))
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 10
+
+    @property
+    def message(self) -> str:
+        return status_message(self.status, self.detail)
+
+    def __repr__(self) -> str:
+        return 'Result(' + self.status.name + ', ' + repr(self.result) + ')'
+
+    # JSON-compatible dict; for a text, only the tokens that were not simply inflected are listed
+    def as_dict(self) -> dict:
+        output = {'status': self.status.name, 'result': self.result}
+        if self.target_tags is not None:
+            output['target_tags'] = self.target_tags.string
+        if self.defaults:
+            output['defaults'] = self.defaults
+        if self.status != Status.OK:
+            output['message'] = self.message
+        if self.tokens is not None:
+            tokens = {str(i): token.as_dict() for i, token in self.tokens.items() if token.status != Status.OK}
+            if len(tokens):
+                output['tokens'] = tokens
+        return output
+
 
 # TagsSearcher takes a tagset and compares it to data presented in out json data:
 # searches if the tagset is in LabelsScheme; sets default values in accordance with ValidFeatures
 class TagsSearcher:
 
-    # refer to ValidFeatures to check the input categories and features are valid 
-    def check_tags(self, tags: dict):
+    # refer to ValidFeatures to check the input categories and features are valid;
+    # returns the status and the detail of the first invalid pair or None
+    def find_invalid(self, tags: dict or TagSet) -> None or tuple:
+        # a TagSet is checked when created, only the pairs that are not
+        # in ValidFeatures are left to be reported
+        if isinstance(tags, TagSet):
+            tags = tags.unknown
         for cat, feat in tags.items():
             # check the category (for example, 'PP', 'VVN' are not accepted)
             if ValidFeatures.get(cat) is None:
-                raise ValueError('Category "' + cat + '" is not supported.\nValid categories are available at ' 
-                                 + valid_features_link + '.')
+                return Status.INVALID_CATEGORY, (cat,)
             # check the feature (for example, 'Dat' is not accepted for 'Number')
             if feat not in ValidFeatures[cat]:
-                raise ValueError('Feature "' + feat + '" is not valid for category "' + cat + 
-                                 '".\nValid features are available at ' + valid_features_link + '.')
+                return Status.INVALID_FEATURE, (feat, cat)
+
+    def check_tags(self, tags: dict or TagSet):
+        invalid = self.find_invalid(tags)
+        if invalid is not None:
+            raise ValueError(status_message(*invalid))
     
     # primary search checks strict match
-    def primary_search(self, morph: str, pos: str) -> bool:
-        self.check_tags(split_tags(morph))
-        return morph not in LabelsScheme.get(pos, [])
+    def primary_search(self, morph: TagSet, pos: str) -> bool:
+        morph = TagSet.of(morph)
+        self.check_tags(morph)
+        return morph.string not in SchemeIndexes[pos].tagsets if pos in SchemeIndexes else True
 
     # secondary search checks partial match: if in label scheme there is such a tagset
     # that for each category-feature pair in it either the feature is in target tagset or 
     # the category is missing there
-    def secondary_search(self, morph: str, pos: str) -> None or str:
-        morph_tags = split_tags(morph)
-        self.check_tags(morph_tags)
-        pattern = re.compile('(\\||^)' + '\\|(\\w+=\\w+\\|)*'.join([cat + '=' + feat 
-                            for cat, feat in sorted(morph_tags.items())]) + '(\\||$)')
-        matches = []
-        for feats in LabelsScheme.get(pos, []):
-            if pattern.search(feats) is not None:
-                matches.append(feats)
-        if not len(matches):
+    def secondary_search(self, morph: TagSet, pos: str) -> None or TagSet:
+        morph = TagSet.of(morph)
+        self.check_tags(morph)
+        res_tags = complete_tags(morph, pos)
+        if stats.enabled:
+            stats.count('tags', 'secondary_search', pos, 'completed' if res_tags is not None else 'failed')
+        if res_tags is None:
             return
-
-        # then if we found such a tagset, we want to set our 
-        # target tagset's missing categories as default;
-        # the default value for each category is [0] element of its list in ValidFeatures 
-        extract_min = lambda m: m[argmin([len(f.split('|')) for f in m])]
-        res_tags = merge_tags({cat: (ValidFeatures[cat][0] if morph_tags.get(cat) is None 
-                                     else morph_tags[cat]) for cat, feat in split_tags(extract_min(matches)).items()})
-        warnings.warn('Provided tags were not found in labels scheme. Some features were set as default.\nResult features are "' +
-                      res_tags + '". You can specify desired features if you wish.\nLabels scheme is available at: ' 
-                      + labels_scheme_link + '.', Warning)
+        stats.count('warnings')
+        warnings.warn(status_message(Status.DEFAULTS, (res_tags.string,)), Warning)
         return res_tags
 
-    
+
+# index of the labels scheme of a POS: the set of its tagsets
+# and an inverted index 'Cat=Feat' -> bitset of ids of the tagsets that contain the pair;
+# the ids are given in order of the tagset length (and of the labels scheme for the equal lengths),
+# so the lowest bit of an intersection is the shortest matching tagset
+class SchemeIndex:
+
+    def __init__(self, tagsets: list):
+        self.tagsets = set(tagsets)
+        self.ordered = sorted(tagsets, key=lambda t: len(t.split('|')))
+        self.pairs = defaultdict(int)
+        for i, tagset in enumerate(self.ordered):
+            for pair in tagset.split('|'):
+                self.pairs[pair] |= 1 << i
+
+    # the shortest tagset that contains all the pairs
+    def search(self, morph_tags: TagSet) -> None or str:
+        if not len(morph_tags):
+            return
+        ids = (1 << len(self.ordered)) - 1
+        for cat, feat in morph_tags.items():
+            ids &= self.pairs.get(cat + '=' + feat, 0)
+            if not ids:
+                return
+        return self.ordered[(ids & -ids).bit_length() - 1]
+
+SchemeIndexes = {pos: SchemeIndex(tagsets) for pos, tagsets in LabelsScheme.items()}
+
+# complete a partial tagset: find the shortest tagset of the labels scheme that contains it
+# and set the missing categories as default;
+# the default value for each category is [0] element of its list in ValidFeatures
+@lru_cache(maxsize=65536)
+def complete_tags(morph_tags: TagSet, pos: str) -> None or TagSet:
+    index = SchemeIndexes.get(pos)
+    match = index.search(morph_tags) if index is not None else None
+    if match is None:
+        return
+    return TagSet.of({cat: (ValidFeatures[cat][0] if morph_tags.get(cat) is None 
+                            else morph_tags.get(cat)) for cat in split_tags(match)})
+
+
+# the inflectors and TagsProcessor only read the text, norm_, lemma_, pos_ and morph of a token,
+# so a word that has been analysed elsewhere (e.g. by another tagger) does not need spaCy:
+# TokenView provides these attributes (see DERBI.inflect_lemma);
+# MorphView stands for spacy.tokens.MorphAnalysis: features in Universal Features
+# notation ('Case=Nom|Number=Plur') or as a dict ({'Case': 'Nom', 'Number': 'Plur'})
+class MorphView:
+
+    __slots__ = ('feats', 'string')
+
+    def __init__(self, feats: str or dict=None):
+        if isinstance(feats, MorphView):
+            feats = feats.feats
+        elif not isinstance(feats, dict):
+            feats = split_tags(str(feats or ''))
+        # as in spaCy, the categories are sorted and each of them maps to a list of features
+        self.feats = {cat: sorted(feat) if isinstance(feat, (list, tuple)) else str(feat).split(',')
+                      for cat, feat in sorted(feats.items())}
+        self.string = '|'.join([cat + '=' + ','.join(feat) for cat, feat in self.feats.items()])
+
+    def get(self, cat: str, default: list=None) -> list:
+        return list(self.feats.get(cat, default or []))
+
+    def to_dict(self) -> dict:
+        return split_tags(self.string)
+
+    def __len__(self) -> int:
+        return len(self.feats)
+
+    def __str__(self) -> str:
+        return self.string
+
+    def __repr__(self) -> str:
+        return 'MorphView(' + repr(self.string) + ')'
+
+
+class TokenView:
+
+    __slots__ = ('text', 'lemma_', 'pos_', 'norm_', 'morph', 'i')
+
+    def __init__(self, text: str, lemma: str, pos: str, morph: str or dict=None, norm: str=None, i: int=0):
+        self.text = text
+        self.lemma_ = lemma
+        self.pos_ = pos.upper()
+        self.norm_ = norm if norm is not None else text.lower()
+        self.morph = MorphView(morph)
+        self.i = i
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __repr__(self) -> str:
+        return 'TokenView(' + ', '.join([repr(self.text), repr(self.lemma_), repr(self.pos_), repr(self.morph.string)]) + ')'
+
+
 # TagsProcessor contains methods for input tags transformation
 # the way we need it
 class TagsProcessor:
@@ -117,8 +459,9 @@ class TagsProcessor:
     def normalize_tags(tags: dict) -> dict:
         return {key.capitalize().strip(): value.capitalize().strip() for key, value in tags.items()}
 
-    # not all the categories can be alternated
-    def filter_target_tags(self, tagset: dict, tok: spacy.tokens.token.Token):
+    # not all the categories can be alternated;
+    # returns the first category of the tagset that cannot be or None
+    def find_fixed(self, tagset: dict, tok: spacy.tokens.token.Token) -> str or None:
         pos = tok.pos_
         # let NOUNs with adjective declination pass           
         if (pos == 'NOUN') and (tagset.get('Declination') is not None):
@@ -132,47 +475,70 @@ class TagsProcessor:
                 actual_feat = tok.morph.get(key)
             if ((key in curr_filter) and (not len(actual_feat)) or
                 (key in curr_filter) and (tagset[key] != actual_feat[0])):
-                raise ValueError('Category "' + key + '" cannot be alternated for POS "' + pos + '".')
+                return key
+
+    def filter_target_tags(self, tagset: dict, tok: spacy.tokens.token.Token):
+        key = self.find_fixed(tagset, tok)
+        if key is not None:
+            raise ValueError(status_message(Status.FIXED_CATEGORY, (key, tok.pos_)))
 
 
+    # the features of the token of the categories that cannot be alternated
+    def fixed_tags(self, tok: spacy.tokens.token.Token) -> dict:
+        morph_tags = self.normalize_tags(split_tags(str(tok.morph)))
+        return {cat: morph_tags[cat] for cat in self.filter.get(tok.pos_, []) if morph_tags.get(cat) is not None}
+
     # main tags processing function 
-    def sub_tags(self, tok: spacy.tokens.token.Token, target_tags: dict) -> str:
+    def sub_tags(self, tok: spacy.tokens.token.Token, target_tags: dict) -> TagSet:
+        status, target_morph, detail = self.resolve_tags(tok, target_tags)
+        if status >= 10:
+            raise ValueError(status_message(status, detail))
+        if status == Status.DEFAULTS:
+            stats.count('warnings')
+            warnings.warn(status_message(status, detail), Warning)
+        return target_morph
+
+    # the same without exceptions and warnings: 
+    # returns the status (OK, DEFAULTS or the failure), the tagset and the detail of the message (see Status)
+    def resolve_tags(self, tok: spacy.tokens.token.Token, target_tags: dict) -> tuple:
         target_tags = self.normalize_tags(target_tags)
         lemma, morph, pos = tok.lemma_, tok.morph, tok.pos_
-        self.filter_target_tags(target_tags, tok)
+        fixed = self.find_fixed(target_tags, tok)
+        if fixed is not None:
+            return Status.FIXED_CATEGORY, None, (fixed, pos)
 
         morph_tags = self.normalize_tags(split_tags(str(morph)))
         # merge and update the features
-        target_morph = '|'.join([cat + '=' + (feat if target_tags.get(cat) is None else target_tags[cat]) 
-                        for cat, feat in sorted({**morph_tags, **target_tags}.items())])
+        target_morph = TagSet.of({**morph_tags, **target_tags})
         
         # replace some features for AUXs and VERBs
-        if (tok.pos_ in ['AUX', 'VERB']) and ('Verbform=Part' in target_morph):
-            target_morph = re.sub('Mood=\w+\|', '', target_morph)
-            target_morph = re.sub('Person=\w+\|', '', target_morph)     
+        if (tok.pos_ in ['AUX', 'VERB']) and (target_morph.get('Verbform') == 'Part'):
+            target_morph = target_morph.without('Mood', 'Person')
             
-        if ('Verbform=' not in target_morph) and (morph.get('VerbForm') == 'Inf'):
-            target_morph = re.sub('VerbForm=Inf', '', target_morph)
+        if ('Verbform' not in target_morph) and (morph.get('VerbForm') == 'Inf'):
+            target_morph = target_morph.without('VerbForm')
 
         # check if the features are supported
-        search_failed = self.Searcher.primary_search(target_morph, pos)
-        if not search_failed:
-            return target_morph
+        invalid = self.Searcher.find_invalid(target_morph)
+        if invalid is not None:
+            return invalid[0], target_morph, invalid[1]
+        if (pos in SchemeIndexes) and (target_morph.string in SchemeIndexes[pos].tagsets):
+            return Status.OK, target_morph, ()
 
         if pos in ['ADJ', 'ADP', 'AUX', 'DET', 'NOUN', 'PRON', 'PROPN', 'VERB']:
             # additional stage for the POSs that can have any forms:
             # there's a chance that the user did not insert all the tags
             # so we will fill it out as default if necessary
-            res_tags = self.Searcher.secondary_search(target_morph, pos)
+            res_tags = complete_tags(target_morph, pos)
+            if stats.enabled:
+                stats.count('tags', 'secondary_search', pos, 'completed' if res_tags is not None else 'failed')
             if res_tags is None:
-                raise ValueError('Features "' + target_morph + '" are not supported for POS "' + pos + 
-                                 '".\nLabels scheme is available at: ' + labels_scheme_link + '.')
-            return res_tags
+                return Status.UNSUPPORTED_FOR_POS, target_morph, (target_morph.string, pos)
+            return Status.DEFAULTS, res_tags, (res_tags.string,)
 
         # if the POS cannot have any forms and the features are not supported:
         # we cannot inflect that
-        raise ValueError('Features "' + target_morph + '" are not supported for word "' + lemma + 
-                         '" of POS "' + pos + '".\nLabels scheme is available at: ' + labels_scheme_link + '.')
+        return Status.UNSUPPORTED_FOR_WORD, target_morph, (target_morph.string, lemma, pos)
         
         
 ''' 
@@ -244,7 +610,10 @@ class Lexicon:
                     rule_dict[cat] = multiple_choice
                 else:
                     rule_dict[cat] = [feat]
-            self.rules[input].append({'rule': rule_dict, 'output': output.strip()})
+            # bitmasks for the fast partial match check
+            cats_mask, excluded_mask = compile_conditions(rule_dict)
+            self.rules[input].append({'rule': rule_dict, 'output': output.strip(), 
+                                      'cats': cats_mask, 'excluded': excluded_mask})
         except: pass
 
 
@@ -282,3 +651,504 @@ class StateMachine:
                     rule_dict[cat] = [feat]
             self.rules.append({'pattern': pattern, 'rule': rule_dict, 'to_sub': to_sub.replace('\n', '')})
         except: pass  
+
+
+# compiled state machine rules: which rules are applicable depends only on the features 
+# of the categories the rules condition, so the chain of the applicable rules 
+# is computed once for each combination of these features (i.e. for each tagset);
+# in a chain each rule is compiled and, if its pattern requires a literal suffix or substring,
+# it gets a prefilter that skips the rule when it cannot match; 
+# the rules that cannot change anything are left out
+class RuleChains:
+
+    # 'lit$', 'lit(?=$)' and '(?<=lit)$' require a literal suffix
+    suffix_pattern = re.compile('^(?:([^\\\\.^$*+?{}\\[\\]|()]+)\\$|([^\\\\.^$*+?{}\\[\\]|()]+)\\(\\?=\\$\\)|\\(\\?<=([^\\\\.^$*+?{}\\[\\]|()]+)\\)\\$)$')
+    # a pattern without special characters is a literal itself
+    literal_pattern = re.compile('^[^\\\\.^$*+?{}\\[\\]|()]+$')
+    # lookarounds (not nested)
+    lookaround_pattern = re.compile('\\(\\?<?[=!][^()]*\\)')
+
+    def __init__(self, rules: list, name: str=''):
+        self.rules, self.name = rules, name
+        # the categories the rules condition
+        self.cats = tuple(sorted({cat for rule in rules for cat in rule['rule']}))
+        self.compiled = [self.compile(rule) for rule in rules]
+        self.chains = {}
+
+    @classmethod
+    def compile(cls, rule: dict) -> tuple or None:
+        pattern, to_sub = rule['pattern'], rule['to_sub']
+        # an empty match substituted with nothing
+        if (to_sub == '') and (cls.lookaround_pattern.sub('', pattern) in ['', '^', '$']):
+            return
+        suffix = cls.suffix_pattern.search(pattern)
+        if suffix is not None:
+            suffix = [group for group in suffix.groups() if group is not None][0]
+        infix = pattern if cls.literal_pattern.search(pattern) is not None else None
+        return re.compile(pattern), to_sub, suffix, infix
+
+    def chain(self, tags_dict: dict) -> tuple:
+        key = tuple([tags_dict.get(cat, '') for cat in self.cats])
+        chain = self.chains.get(key)
+        if chain is None:
+            # here we require full match 
+            chain = tuple([compiled for rule, compiled in zip(self.rules, self.compiled) if (compiled is not None) and 
+                           all([tags_dict.get(cat, '') in feats for cat, feats in rule['rule'].items()])])
+            # the keys are the features of the valid tagsets, but who knows
+            if len(self.chains) < 65536:
+                self.chains[key] = chain
+        return chain
+
+    def __call__(self, token: str, tags_dict: dict) -> str:
+        fired = 0
+        for pattern, to_sub, suffix, infix in self.chain(tags_dict):
+            if ((suffix is not None) and (not token.endswith(suffix))) or ((infix is not None) and (infix not in token)):
+                continue
+            token = pattern.sub(to_sub, token)
+            fired += 1
+        if stats.enabled:
+            stats.count('automata', self.name, 'calls')
+            stats.count('automata', self.name, 'rules_fired', n=fired)
+        return token
+
+
+# interpreted rules are serialized to meta/compiled, so that the rule text
+# is interpreted once and not on every start; the name of a compiled file
+# contains a hash of everything the interpretation depends on: the rule file,
+# ValidFeatures (the bitmasks) and this module itself, so any change of them 
+# invalidates the compiled rules
+CompiledRules = package_path('./meta/compiled')
+
+with open(package_path('./meta/ValidFeatures.json'), 'rb') as f, open(os.path.abspath(__file__), 'rb') as t:
+    rules_salt = hashlib.sha256(f.read() + t.read()).digest()
+
+def compiled_rules_path(rules_class: type, rules_path: str) -> str:
+    with open(rules_path, 'rb') as f:
+        digest = hashlib.sha256(rules_salt + f.read()).hexdigest()[:16]
+    name = rules_class.__name__ + '.' + os.path.basename(rules_path) + '.' + digest + '.pickle'
+    return os.path.join(CompiledRules, name)
+
+def compile_rules(rules_class: type, rules_path: str):
+    compiled_path = compiled_rules_path(rules_class, rules_path)
+    try:
+        with open(compiled_path, 'rb') as f:
+            return pickle.load(f)
+    # not compiled yet or broken
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass
+    rules = rules_class(rules_path).rules
+    # read-only installations just interpret the rules every time
+    try:
+        os.makedirs(CompiledRules, exist_ok=True)
+        prefix = os.path.basename(compiled_path).rsplit('.', 2)[0] + '.'
+        for name in os.listdir(CompiledRules):
+            # outdated versions
+            if name.startswith(prefix) and name.endswith('.pickle'):
+                os.remove(os.path.join(CompiledRules, name))
+        # write to a temporary file first, so that concurrent processes
+        # never read a half-written file
+        tmp_path = compiled_path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(rules, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, compiled_path)
+    except OSError:
+        pass
+    return rules
+
+# the rules are shared by all the inflectors (and all the DERBI instances) of the process:
+# each rule file is loaded at most once, when it is needed for the first time
+loaded_rules = {}
+rules_lock = threading.Lock()
+
+def load_rules(rules_class: type, rules_path: str):
+    rules_path = package_path(rules_path)
+    key = (rules_class.__name__, rules_path)
+    rules = loaded_rules.get(key)
+    if rules is None:
+        with rules_lock:
+            rules = loaded_rules.get(key)
+            if rules is None:
+                rules = loaded_rules[key] = compile_rules(rules_class, rules_path)
+    return rules
+
+# the same for the rule chains of a state machine (see RuleChains)
+def load_chains(rules_path: str) -> RuleChains:
+    rules = load_rules(StateMachine, rules_path)
+    key = ('RuleChains', package_path(rules_path))
+    chains = loaded_rules.get(key)
+    if chains is None:
+        with rules_lock:
+            chains = loaded_rules.get(key)
+            if chains is None:
+                chains = loaded_rules[key] = RuleChains(rules, os.path.basename(rules_path))
+    return chains
+
+
+# optional instrumentation of the process (the rules and the inflectors are shared 
+# by all the DERBI instances, so are the stats): counters and timings of the stages;
+# disabled by default, then a counter costs one attribute check and a timer 
+# returns a shared no-op context; the snapshots can be passed to exporters 
+# (callables taking a snapshot), on demand (export()) or every export_interval seconds
+class Stats:
+
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        # stage -> [count, total seconds, max seconds]
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+        self.exporters = []
+        self.export_interval, self.last_export = None, time()
+
+    # a lock cannot be pickled: the counters are pickled without it
+    def __getstate__(self) -> dict:
+        state = {key: value for key, value in self.__dict__.items() if key != 'lock'}
+        state['counters'], state['timings'] = dict(self.counters), dict(self.timings)
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int, self.counters)
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0], self.timings)
+
+    def enable(self, export_interval: float=None):
+        self.export_interval = export_interval
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+
+    def count(self, *name, n: int=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters['.'.join(name)] += n
+
+    def record(self, stage: str, seconds: float):
+        with self.lock:
+            timing = self.timings[stage]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    # with stats.timer('inflector', 'NOUN'): ...
+    # times the block as stage 'inflector.NOUN' and counts the exceptions raised in it
+    def timer(self, *stage):
+        if not self.enabled:
+            return no_timer
+        return StageTimer(self, '.'.join(stage))
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'counters': dict(self.counters),
+                'timings': {stage: {'count': count, 'total_ms': total * 1000, 'mean_ms': total * 1000 / count, 'max_ms': maximum * 1000}
+                            for stage, (count, total, maximum) in self.timings.items()}
+                }
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def remove_exporter(self, exporter):
+        self.exporters.remove(exporter)
+
+    def export(self) -> dict:
+        snapshot = self.snapshot()
+        self.last_export = time()
+        for exporter in self.exporters:
+            exporter(snapshot)
+        return snapshot
+
+    # export if export_interval has passed since the last export
+    def tick(self):
+        if self.enabled and (self.export_interval is not None) and len(self.exporters) and \
+                                                    (time() - self.last_export >= self.export_interval):
+            self.export()
+
+class StageTimer:
+
+    def __init__(self, stats: Stats, stage: str):
+        self.stats, self.stage = stats, stage
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stats.record(self.stage, perf_counter() - self.start)
+        if exc_type is not None:
+            self.stats.count('errors', self.stage, exc_type.__name__)
+        return False
+
+no_timer = nullcontext()
+
+stats = Stats()
+
+
+# size-bounded least recently used cache;
+# counts hits, misses and evictions;
+# can be shared between threads
+class LRUCache:
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.lock = threading.Lock()
+
+    # a lock cannot be pickled (nor can some of the entries, e.g. spaCy tokens):
+    # a pickled cache is restored empty, with its size
+    def __getstate__(self) -> dict:
+        return {'maxsize': self.maxsize}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['maxsize'])
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, key) -> bool:
+        return key in self.data
+
+    def full(self) -> bool:
+        return len(self.data) >= self.maxsize
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is None:
+                self.misses += 1
+                return
+            self.hits += 1
+            self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.data), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+# cache of parsed texts: the same texts (e.g. template sentences inflected
+# with different target tags) are parsed by the model only once;
+# the docs are kept in memory (LRU) and, if path is given, also on disk:
+# one DocBin file per text in <path>/<model name>, named by the hash of the text,
+# so that the cache is shared by the processes and survives restarts;
+# the docs are not modified by DERBI, so the cached ones are returned as they are
+class ParseCache:
+
+    def __init__(self, model: spacy.lang.de.German, maxsize: int, path: str=None):
+        self.model = model
+        self.model_name = model.meta.get('lang', 'de') + '_' + model.meta.get('name', 'pipeline') + '-' + model.meta.get('version', '')
+        self.memory = LRUCache(maxsize)
+        # the memory LRU counts a doc read from disk as its miss, so the lookups are counted here
+        self.memory_hits, self.disk_hits, self.misses = 0, 0, 0
+        self.lock = threading.Lock()
+        self.path = None
+        if path is not None:
+            self.path = os.path.join(path, self.model_name)
+            os.makedirs(self.path, exist_ok=True)
+
+    # as LRUCache, a pickled cache is restored without the lock and with the counters reset
+    def __getstate__(self) -> dict:
+        return {key: value for key, value in self.__dict__.items() if key != 'lock'}
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.memory_hits, self.disk_hits, self.misses = 0, 0, 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.path, key + '.spacy')
+
+    # the doc of the text or None if it has not been parsed yet
+    def get(self, text: str) -> spacy.tokens.Doc or None:
+        key = self.text_key(text)
+        doc, source = self.memory.get(key), 'memory_hits'
+        if (doc is None) and (self.path is not None):
+            try:
+                docs = list(spacy.tokens.DocBin().from_disk(self.file_path(key)).get_docs(self.model.vocab))
+            # not on disk or broken in any way: a miss
+            except Exception:
+                docs = []
+            # (hash collisions are not trusted)
+            if len(docs) and (docs[0].text == text):
+                doc, source = docs[0], 'disk_hits'
+                self.memory.put(key, doc)
+        if doc is None:
+            source = 'misses'
+        with self.lock:
+            setattr(self, source, getattr(self, source) + 1)
+        if stats.enabled:
+            stats.count('parse_cache', source)
+        return doc
+
+    def put(self, text: str, doc: spacy.tokens.Doc):
+        key = self.text_key(text)
+        self.memory.put(key, doc)
+        if self.path is not None:
+            # write to a temporary file first, so that the other processes never read a partial file;
+            # the user data (extension attributes etc.) is not needed to inflect and may not be serializable
+            tmp_path = self.file_path(key) + '.' + str(os.getpid()) + '.tmp'
+            try:
+                spacy.tokens.DocBin(docs=[doc], store_user_data=False).to_disk(tmp_path)
+                os.replace(tmp_path, self.file_path(key))
+            # a doc that cannot be written is just not cached on disk
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def __call__(self, text: str) -> spacy.tokens.Doc:
+        doc = self.get(text)
+        if doc is None:
+            doc = self.model(text)
+            self.put(text, doc)
+        return doc
+
+    # memory_hits, disk_hits and misses are the lookups of get;
+    # size, maxsize and evictions are the ones of the memory LRU
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        with self.lock:
+            return {'size': memory['size'], 'maxsize': memory['maxsize'], 'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': memory['evictions'], 'path': self.path}
+
+
+# minimal pipelines: DERBI only reads the text, norm_, pos_, morph and lemma_ of the tokens,
+# so the components that predict anything else (syntax, entities, sentences, categories) 
+# are not needed; nor are the word vectors, unless a needed component uses them as features
+unneeded_factories = ['parser', 'beam_parser', 'ner', 'beam_ner', 'senter', 'sentencizer', 'entity_ruler', 'entity_linker',
+                      'span_ruler', 'spancat', 'spancat_singlelabel', 'span_finder', 'textcat', 'textcat_multilabel']
+
+# the config of a pipeline (a package name or a path) or None if it cannot be found
+def model_config(name: str) -> dict or None:
+    if spacy is None:
+        return
+    path = name
+    if (not os.path.exists(path)) and spacy.util.is_package(name):
+        package = str(spacy.util.get_package_path(name))
+        # the data of a package is in its subdirectory <name>-<version>
+        path = next((os.path.join(package, sub) for sub in sorted(os.listdir(package)) 
+                     if os.path.exists(os.path.join(package, sub, 'config.cfg'))), package)
+    try:
+        return spacy.util.load_config(os.path.join(path, 'config.cfg'), interpolate=False)
+    except (OSError, ValueError):
+        return
+
+def uses_static_vectors(config) -> bool:
+    if isinstance(config, dict):
+        if ((config.get('include_static_vectors') is True) or config.get('pretrained_vectors') or
+            ('StaticVectors' in str(config.get('@architectures', '')))):
+            return True
+        return any(uses_static_vectors(value) for value in config.values())
+    if isinstance(config, (list, tuple)):
+        return any(uses_static_vectors(value) for value in config)
+    return False
+
+# the components (and the vectors) to be excluded when the pipeline is loaded for DERBI
+def minimal_exclude(name: str, exclude_vectors: bool=True) -> list:
+    config = model_config(name)
+    # unknown pipeline: only the components that are known to be unneeded by name
+    if config is None:
+        return ['parser', 'ner', 'senter']
+    components = config.get('components', {})
+    exclude = [component for component in config.get('nlp', {}).get('pipeline', []) 
+               if components.get(component, {}).get('factory') in unneeded_factories]
+    kept = [components.get(component, {}) for component in config.get('nlp', {}).get('pipeline', []) if component not in exclude]
+    if exclude_vectors and not uses_static_vectors(kept):
+        exclude.append('vectors')
+    return exclude
+
+
+# read-only on-disk store of precomputed forms;
+# the file is memory-mapped, so all the processes that open
+# the same store share one copy of it in the page cache;
+# layout: magic, number of records N, N offsets of the records 
+# sorted by key, the records; each record is 'key\0form\0',
+# where key is the inflection cache key with parts separated by '\x1f'
+class ParadigmStore:
+
+    magic = b'DERBIPS1'
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as store_file:
+            self.mm = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(self.magic)] != self.magic:
+            raise ValueError('File "' + path + '" is not a paradigm store.')
+        self.size = struct.unpack_from('<Q', self.mm, 8)[0]
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def encode_key(key: tuple) -> bytes:
+        return '\x1f'.join([str(part) for part in key]).encode('utf-8')
+
+    # binary search over the sorted records
+    def get(self, key: tuple) -> str or None:
+        key = self.encode_key(key)
+        lo, hi = 0, self.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = struct.unpack_from('<Q', self.mm, 16 + 8 * mid)[0]
+            end = self.mm.find(b'\0', offset)
+            current = self.mm[offset:end]
+            if current < key:
+                lo = mid + 1
+            elif current > key:
+                hi = mid
+            else:
+                return self.mm[end + 1:self.mm.find(b'\0', end + 1)].decode('utf-8')
+
+    def close(self):
+        self.mm.close()
+
+    # a memory map cannot be pickled (e.g. to be sent to another process),
+    # so we pickle the path and map the file again
+    def __getstate__(self) -> dict:
+        return {'path': self.path}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['path'])
+
+    # entries is an iterable of (key, form) pairs
+    @classmethod
+    def build(cls, path: str, entries):
+        records = {cls.encode_key(key): form.encode('utf-8') for key, form in entries}
+        keys = sorted(records)
+        offsets, data = [], bytearray()
+        start = 16 + 8 * len(keys)
+        for key in keys:
+            offsets.append(start + len(data))
+            data += key + b'\0' + records[key] + b'\0'
+        # write to a temporary file first, so that the processes 
+        # which have the old store open are not affected
+        with open(path + '.tmp', 'wb') as store_file:
+            store_file.write(cls.magic + struct.pack('<Q', len(keys)) + struct.pack('<' + 'Q' * len(keys), *offsets))
+            store_file.write(data)
+        os.replace(path + '.tmp', path)
@@ -0,0 +1,166 @@
+# Copyright 2022 Max Schmaltz: @maxschmaltz
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ************************************************************************
+
+# import required modules
+from collections import deque
+from itertools import islice
+import argparse
+import json
+import multiprocessing
+import sys
+import warnings
+
+'''
+Command line entry point:
+    python -m DERBI --model de_core_news_sm < requests.jsonl > results.jsonl
+Each input line is a JSON object {"text": ..., "target_tags": ..., "indices": ...}
+(the arguments of DERBI.__call__; "id", if present, is copied to the output);
+each output line is the structured result of the request (see Tools.Result.as_dict):
+{"status": ..., "result": ..., ...}, in the input order; the requests that failed
+have a "message", the texts where some of the tokens failed list them in "tokens".
+There is exactly one output line per input line: a blank or invalid line
+gets a BAD_REQUEST result (with the "id" of the line, if it can be read).
+The input is read and processed in batches (with DERBI.pipe in structured mode, 
+so that an invalid request only affects itself); the batches are distributed among
+the worker processes, each of which loads the model once. At most max_in_flight batches
+are read but not yet written, so that input of any size can be streamed through.
+'''
+
+# DERBI instance of the process (see init_worker)
+derbi = None
+# if the model could not be loaded in a worker, the error is raised 
+# at its first batch (a pool whose initializer fails restarts the workers forever)
+init_error = None
+
+def init_worker(model_name: str, cache_size: int, parse_cache_size: int, show_warnings: bool, full_pipeline: bool=False):
+    global derbi, init_error
+    if not show_warnings:
+        warnings.simplefilter('ignore')
+    try:
+        import spacy
+        from DERBI.derbi import DERBI
+        # only the components DERBI needs are loaded (see DERBI.from_name)
+        if full_pipeline:
+            derbi = DERBI(spacy.load(model_name), cache_size=cache_size, parse_cache_size=parse_cache_size)
+        else:
+            derbi = DERBI.from_name(model_name, cache_size=cache_size, parse_cache_size=parse_cache_size)
+    except Exception as e:
+        init_error = e
+
+def bad_request(e: Exception, request_id=None) -> dict:
+    output = {'status': 'BAD_REQUEST', 'result': None, 'message': str(e)}
+    return output if request_id is None else dict(id=request_id, **output)
+
+# the id of a line that is not a valid request, if it is a JSON object with an id
+def line_id(line: str):
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return
+    return request.get('id') if isinstance(request, dict) else None
+
+# parse a line of the input into a request (text, target_tags, indices)
+def parse_request(line: str) -> tuple:
+    if not line.strip():
+        raise ValueError('Empty line.')
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError('Request must be a JSON object.')
+    if not isinstance(request.get('text'), str):
+        raise ValueError('Request must contain "text" (a string).')
+    return request.get('id'), (request['text'], request.get('target_tags'), request.get('indices', 0))
+
+# process a batch of input lines; returns the output lines
+def process_batch(lines: list) -> list:
+    if init_error is not None:
+        raise init_error
+    outputs, requests = [None] * len(lines), []
+    for i, line in enumerate(lines):
+        try:
+            requests.append((i, *parse_request(line)))
+        except Exception as e:
+            outputs[i] = bad_request(e, line_id(line))
+    try:
+        results = list(derbi.pipe([request for _, _, request in requests], batch_size=max(1, len(requests)), structured=True))
+    # the batch could not be parsed: the requests are processed one by one
+    except Exception:
+        results = [derbi(*request, structured=True) for _, _, request in requests]
+    for (i, request_id, _), result in zip(requests, results):
+        outputs[i] = result.as_dict()
+        if request_id is not None:
+            outputs[i] = dict(id=request_id, **outputs[i])
+    return [json.dumps(output, ensure_ascii=False) for output in outputs]
+
+# batches of the input lines (the blank ones included, see parse_request)
+def read_batches(input_file, batch_size: int):
+    lines = iter(input_file)
+    while True:
+        batch = list(islice(lines, batch_size))
+        if not len(batch):
+            return
+        yield batch
+
+def run(input_file, output_file, model_name: str='de_core_news_sm', n_workers: int=1, batch_size: int=256,
+        max_in_flight: int=None, cache_size: int=65536, parse_cache_size: int=0, show_warnings: bool=False,
+        full_pipeline: bool=False):
+    init_args = (model_name, cache_size, parse_cache_size, show_warnings, full_pipeline)
+    batches = read_batches(input_file, batch_size)
+    if n_workers <= 1:
+        init_worker(*init_args)
+        if init_error is not None:
+            raise init_error
+        for batch in batches:
+            output_file.write('\n'.join(process_batch(batch)) + '\n')
+        return
+
+    max_in_flight = max_in_flight or 2 * n_workers
+    with multiprocessing.Pool(n_workers, initializer=init_worker, initargs=init_args) as pool:
+        # the results are written in the input order;
+        # no more batches are read while max_in_flight of them are pending
+        pending = deque()
+        for batch in batches:
+            if len(pending) >= max_in_flight:
+                output_file.write('\n'.join(pending.popleft().get()) + '\n')
+            pending.append(pool.apply_async(process_batch, (batch,)))
+        while len(pending):
+            output_file.write('\n'.join(pending.popleft().get()) + '\n')
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(prog='python -m DERBI', description='Inflect JSONL requests with DERBI.')
+    parser.add_argument('input', nargs='?', default='-', help='input JSONL file (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='output JSONL file (default: stdout)')
+    parser.add_argument('-m', '--model', default='de_core_news_sm', help='German spaCy pipeline')
+    parser.add_argument('-w', '--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('-b', '--batch-size', type=int, default=256, help='requests per batch')
+    parser.add_argument('--max-in-flight', type=int, default=None, help='batches read but not yet written (default: 2 * workers)')
+    parser.add_argument('--cache-size', type=int, default=65536, help='size of the inflection cache of each worker')
+    parser.add_argument('--parse-cache-size', type=int, default=0, help='size of the parse cache of each worker')
+    parser.add_argument('--warnings', action='store_true', help='show DERBI warnings')
+    parser.add_argument('--full-pipeline', action='store_true', help='load all the components of the model (parser, ner, vectors)')
+    args = parser.parse_args(argv)
+
+    input_file = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    output_file = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        run(input_file, output_file, args.model, args.workers, args.batch_size, args.max_in_flight,
+            args.cache_size, args.parse_cache_size, args.warnings, args.full_pipeline)
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+if __name__ == '__main__':
+    main()
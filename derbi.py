@@ -13,20 +13,41 @@
 # limitations under the License.
 # ************************************************************************
 
+from __future__ import annotations
+
+import os, sys
+ROOT = os.path.dirname(__file__)
+depth = 0
+for _ in range(depth): ROOT = os.path.dirname(ROOT)
+sys.path.append(ROOT)
+
 # import required modules
+from collections import deque
+from itertools import chain, islice
+from typing import Optional
 import json
 import re
 import warnings
-# import spaCy
-import spacy
+# import spaCy; without it, only the words with known analyses can be inflected
+# (see inflect_lemma), the texts cannot be parsed
+try:
+    import spacy
+    import spacy.lang.de
+    from spacy.language import Language
+except ImportError:
+    spacy = None
 # import required scripts
 # from DERBI import Tools, Inflectors
 import Tools, Inflectors
 # Router contains information about 
 # __init__ of each pos inflector
-with open('./Router.json') as r:
+with open(Tools.package_path('./Router.json')) as r:
     Router = json.load(r)
 
+# the input text has already been parsed
+def is_doc(text) -> bool:
+    return (spacy is not None) and isinstance(text, spacy.tokens.Doc)
+
     
 # wrapper for inflection
 '''
@@ -54,118 +75,622 @@ Wrapper performance consists of three stages:
 '''
 class DERBI:
 
-    def __init__(self, model: spacy.lang.de.German):
+    def __init__(self, model: spacy.lang.de.German or None, cache_size: int=65536, paradigm_store: str=None, instrument: bool=False,
+                 parse_cache_size: int=0, parse_cache_dir: str=None):
         # as the model uses spaCy, we require one of the German spaCy models;
-        # any is accepted
-        if not isinstance(model, spacy.lang.de.German):
+        # any is accepted; with model=None, DERBI does not need spaCy at all,
+        # but it can only inflect the words with known analyses (see inflect_lemma)
+        if (model is not None) and ((spacy is None) or (not isinstance(model, spacy.lang.de.German))):
             raise TypeError('You should use one of the German spaCy pipelines: https://spacy.io/models/de')
         self.model = model
         # with TagsProcessor we will process the input tags (surprisingly!) 
         self.TagsProcessor = Tools.TagsProcessor()
-        # create an instance of inflector for each POS
-        for pos, args in Router.items():
-            inflector_name, fa_path, lexc_path = tuple(args)
-            setattr(self, pos.lower() + '_inflector', getattr(Inflectors, inflector_name)(fa_path, lexc_path))
-
-    def inflect(self, token: spacy.tokens.token.Token, target_tags: str) -> str:
-        # check if the token consist of german abc letters
-        german_abc_ext = re.compile('[^a-zäöüß]')
-        if german_abc_ext.search(token.norm_) is not None:
-            warnings.warn('Word "' + token.norm_ + '" contains invalid characters. It will not be processed.')
+        # the inflectors (one for each POS, see Router) are shared by all the instances
+        # and created only when needed (see __getattr__)
+        # inflection results are cached: the inflectors are pure functions
+        # of a few token attributes and the target tags (see BasicInflector.cache_key);
+        # cache_size=0 (or None) turns caching off
+        self.cache = Tools.LRUCache(cache_size) if cache_size else None
+        # precomputed forms (see build_paradigm_store) are looked up before the rules are applied
+        self.store = Tools.ParadigmStore(paradigm_store) if paradigm_store is not None else None
+        # parsed texts (see Tools.ParseCache): parse_cache_size docs are kept in memory
+        # and, if parse_cache_dir is given, all of them on disk; off by default
+        self.parse_cache = Tools.ParseCache(model, parse_cache_size or 0, parse_cache_dir) \
+            if (model is not None) and (parse_cache_size or (parse_cache_dir is not None)) else None
+        # parsed lemmas for the participles check (see participle_lemma)
+        self.lemma_tokens = Tools.LRUCache(4096)
+        # counters and timings of the process (see stats); 
+        # they can also be turned on with Tools.stats.enable()
+        if instrument:
+            Tools.stats.enable()
+
+    # construct DERBI with a minimal pipeline: the model is loaded by name (or path)
+    # without the components DERBI does not need (parser, ner, ..., see Tools.minimal_exclude)
+    # and, if exclude_vectors and none of the rest use them, without the word vectors;
+    # then the pipeline is checked (see check_model); kwargs are passed to __init__
+    @classmethod
+    def from_name(cls, name: str, exclude_vectors: bool=True, check: bool=True, **kwargs) -> 'DERBI':
+        if spacy is None:
+            raise ImportError('spaCy is required to load a pipeline; without it, use DERBI(None).inflect_lemma.')
+        model = spacy.load(name, exclude=Tools.minimal_exclude(name, exclude_vectors))
+        if check:
+            cls.check_model(model)
+        return cls(model, **kwargs)
+
+    # make sure the pipeline assigns the attributes the inflectors read
+    probe_text = 'Die kleinen Kinder spielten gestern mit ihrem neuen Hund im Garten.'
+
+    @classmethod
+    def check_model(cls, model: spacy.lang.de.German):
+        if (spacy is None) or (not isinstance(model, spacy.lang.de.German)):
+            raise TypeError('You should use one of the German spaCy pipelines: https://spacy.io/models/de')
+        doc = model(cls.probe_text)
+        missing = [attr for attr, assigned in [('pos_', all([token.pos_ for token in doc])), 
+                                               ('lemma_', all([token.lemma_ for token in doc])),
+                                               ('morph', any([len(token.morph) for token in doc]))] if not assigned]
+        if len(missing):
+            raise ValueError('Pipeline ' + repr(model.pipe_names) + ' does not assign ' + ', '.join(missing) + 
+                             ' that DERBI requires; include the tagger, the morphologizer and the lemmatizer.')
+
+    # obtain the inflector for a POS as self.<pos>_inflector; 
+    # at the first call for the POS in the process its rules are loaded
+    def __getattr__(self, name: str):
+        if name.endswith('_inflector') and (Router.get(name[:-len('_inflector')].upper()) is not None):
+            inflector = Inflectors.load_inflector(*Router[name[:-len('_inflector')].upper()])
+            setattr(self, name, inflector)
+            return inflector
+        raise AttributeError('\'' + type(self).__name__ + '\' object has no attribute \'' + name + '\'')
+
+    # the adjective endings of a participle used as an adjective
+    participle_ending = re.compile('(e[mnrs]?)?')
+
+    # check if the word is a participle of the infinitive (with an adjective ending or without one)
+    # by the verb paradigms: the present participle is the infinitive + d, the past one is generated
+    # by the rules (and the lexicon); a participle the rules do not generate right is never matched
+    def is_participle(self, word: str, infinitive: str) -> bool:
+        if not infinitive.endswith('n'):
+            return False
+        try:
+            past = self.lookup(self.verb_inflector, Tools.TokenView(infinitive, infinitive, 'VERB'),
+                               Tools.TagSet.of({'Tense': 'Past', 'Verbform': 'Part'}))
+        except ValueError:
+            return False
+        return any([word.startswith(participle) and (self.participle_ending.fullmatch(word[len(participle):]) is not None)
+                    for participle in (infinitive + 'd', past.lower())])
+
+    # spaCy considers VERB Verbform=Part as ADJ, so for ADJs we check if the lemma is a verb;
+    # text is the word itself; returns the token of the verb lemma if it is and None otherwise
+    def participle_lemma(self, lemma: str, text: str=None) -> spacy.tokens.token.Token or Tools.TokenView or None:
+        # first we try to decide without the model:
+            # known adjectives and the words that cannot be 
+            # neither an infinitive nor a participle are not verbs
+        if (lemma.lower() in self.adj_inflector.lexc_rules) or (re.search('(n|nd|t)$', lemma.lower()) is None):
+            return
+            # the words that are participles of their lemmas by the verb paradigms are verbs
+        if (text is not None) and self.is_participle(text.lower(), lemma.lower()):
+            return Tools.TokenView(lemma, lemma, 'VERB')
+        # else we parse the lemma (only once), if there is a model to parse it with
+        if self.model is None:
+            return
+        lemma_token = self.lemma_tokens.get(lemma)
+        if lemma_token is None:
+            lemma_token = self.model(lemma)[0]
+            lemma_token = lemma_token if lemma_token.pos_ == 'VERB' else False
+            self.lemma_tokens.put(lemma, lemma_token)
+        return lemma_token or None
+
+    # without a model (see __init__) the texts cannot be parsed
+    def check_parser(self):
+        if self.model is None:
+            raise ValueError('No spaCy pipeline was given, so the texts cannot be parsed; use inflect_lemma instead.')
+
+    # parse the text with the model (or take it from the parse cache)
+    def parse(self, text: str) -> spacy.tokens.Doc:
+        self.check_parser()
+        if self.parse_cache is not None:
+            return self.parse_cache(text)
+        return self.model(text)
+
+    # check if the token consist of german abc letters
+    invalid_characters = re.compile('[^a-zäöüß]')
+
+    @classmethod
+    def check_token(cls, token: spacy.tokens.token.Token) -> bool:
+        if cls.invalid_characters.search(token.norm_) is not None:
+            Tools.stats.count('warnings')
+            warnings.warn(Tools.status_message(Tools.Status.SKIPPED_CHARACTERS, (token.norm_,)))
+            return False
+        return True
+
+    def inflect(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet or str) -> str:
+        target_tags = Tools.TagSet.of(target_tags)
+        if not self.check_token(token):
             return token.norm_
         # check if some tags were provided
-        if target_tags == '':
-            warnings.warn('No tags for word "' + token.norm_ + '" were provided; it will not be inflected.', Warning)
+        if not len(target_tags):
+            Tools.stats.count('warnings')
+            warnings.warn(Tools.status_message(Tools.Status.SKIPPED_NO_TAGS, (token.norm_,)), Warning)
             return token.norm_
+        return self.dispatch(token, target_tags)
+
+    # pass a checked token to its inflector (through the paradigm store and the cache)
+    def dispatch(self, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
         # spaCy considers VERB Verbform=Part as ADJ, so we will catch it and redirect
-        if (token.pos_ == 'ADJ') and (self.model(token.lemma_)[0].pos_ == 'VERB'):
+        lemma_token = self.participle_lemma(token.lemma_, token.text) if token.pos_ == 'ADJ' else None
+        if lemma_token is not None:
             if re.search('nd(e[mnrs]{0,1}){0,1}$', token.text.lower()) is not None:
-                return self.verb_inflector(self.model(token.lemma_), re.sub('Degree=\w+\|', '', target_tags) + 'Tense=Pres|Verbform=Part')
+                token, target_tags = lemma_token, target_tags.without('Degree').update({'Tense': 'Pres', 'Verbform': 'Part'})
             else:
-                return self.verb_inflector(self.model(token.lemma_), re.sub('Degree=\w+\|', '', target_tags) + 'Tense=Past|Verbform=Part')
+                token, target_tags = lemma_token, target_tags.without('Degree').update({'Tense': 'Past', 'Verbform': 'Part'})
         # define needed inflector and inflect
         inflector = getattr(self, token.pos_.lower() + '_inflector')
-        return inflector(token, target_tags)
-    
-    @classmethod
-    def mask(cls, text):
-        mapping = lambda char: 'u' if char.isupper() else 'l'
-        mask = [mapping(char) for char in text]
-        mask = ''.join(mask)
-        return mask
-    
+        # the inflectors are timed by POS (see stats)
+        if Tools.stats.enabled:
+            with Tools.stats.timer('inflector', token.pos_):
+                return self.lookup(inflector, token, target_tags)
+        return self.lookup(inflector, token, target_tags)
 
-    @classmethod
-    def remask(cls, text, mask):
-        result = ''
-        for i, char in enumerate(text):
-            if i >= len(mask): result += char
-            else: result += char.upper() if mask[i] == 'u' else char.lower()
+    # the paradigm store first, then the cache, then the rules
+    def lookup(self, inflector: Inflectors.BasicInflector, token: spacy.tokens.token.Token, target_tags: Tools.TagSet) -> str:
+        if (self.cache is None) and (self.store is None):
+            return inflector(token, target_tags)
+        key = (token.pos_,) + inflector.cache_key(token, target_tags)
+        if self.store is not None:
+            result = self.store.get(key)
+            if result is not None:
+                Tools.stats.count('store', 'hits')
+                return result
+        if self.cache is None:
+            return inflector(token, target_tags)
+        result = self.cache.get(key)
+        if result is None:
+            result = inflector(token, target_tags)
+            self.cache.put(key, result)
         return result
-    
 
+    # all the forms of a word at once: {tagset: form} for each tagset of the labels scheme 
+    # of its POS the word can be inflected to; the word is either a token (or a Tools.TokenView) or a text of one word;
+    # the work that does not depend on the tagset (checks, parsing, prefix separation, 
+    # compound splitting) is done once and the automata share the results of the common rule prefixes
+    def paradigm(self, word: str or spacy.tokens.token.Token or Tools.TokenView) -> dict:
+        if not isinstance(word, str):
+            token = word
+        else:
+            doc = self.parse(word)
+            if len(doc) != 1:
+                raise ValueError('Paradigm can be built only for a single word; "' + word + '" consists of ' + 
+                                 str(len(doc)) + ' tokens.')
+            token = doc[0]
+        if not self.check_token(token):
+            return {}
+        # the categories that cannot be alternated (see Tools.TagsProcessor.filter) restrict the paradigm;
+        # the verb form, though, is a part of the paradigm of a verb
+        fixed = {cat: feat for cat, feat in self.TagsProcessor.fixed_tags(token).items() if cat != 'Verbform'}
+        morph = str(token.morph)
+        paradigm = {}
+        with Inflectors.shared_results():
+            for tagset in map(Tools.TagSet.of, Tools.LabelsScheme.get(token.pos_, [])):
+                if any([tagset.get(cat, feat) != feat for cat, feat in fixed.items()]):
+                    continue
+                if tagset == morph:
+                    paradigm[tagset.string] = token.text
+                    continue
+                try:
+                    form = self.dispatch(token, tagset)
+                # not every tagset is applicable to every word
+                except (Tools.InflectionError, ValueError):
+                    continue
+                paradigm[tagset.string] = self.transfer_case(form, token.text)
+        return paradigm
+
+    # hits, misses and evictions of the inflection cache
+    def cache_info(self) -> dict or None:
+        return None if self.cache is None else self.cache.stats()
+
+    # snapshot of the instrumentation (see Tools.Stats): counters 
+    # (lexicon hits and misses by lexicon file, automata calls and fired rules by rules file, 
+    # compound splitter calls, secondary search fallbacks by POS, warnings, errors by stage)
+    # and timings (parse, sub_tags, inflect, inflector.<POS>, reassembly) of the process,
+    # and the inflection cache stats of the instance
+    def stats(self, reset: bool=False) -> dict:
+        snapshot = Tools.stats.snapshot()
+        snapshot['cache'] = self.cache_info()
+        snapshot['parse_cache'] = None if self.parse_cache is None else self.parse_cache.stats()
+        if reset:
+            Tools.stats.reset()
+        return snapshot
+
+    # compute all the forms available for the POS of the lemma in labels scheme;
+    # yields (cache key, form) pairs
+    def forms(self, lemma: str, pos: str):
+        if Router.get(pos) is None:
+            return
+        inflector = getattr(self, pos.lower() + '_inflector')
+        token = Tools.TokenView(lemma, lemma, pos)
+        for tagset in map(Tools.TagSet.of, Tools.LabelsScheme.get(pos, [])):
+            key = (pos,) + inflector.cache_key(token, tagset)
+            try:
+                yield key, inflector(token, tagset)
+            # not every tagset is applicable to every lemma
+            except (Tools.InflectionError, ValueError):
+                continue
+
+    # fill the inflection cache in advance:
+    # lemmas is an iterable of (lemma, POS) pairs sorted by frequency
+    # (the most frequent first); we cache the forms of each lemma 
+    # until the cache is full; returns the number of the cached forms
+    def warm_cache(self, lemmas) -> int:
+        if self.cache is None:
+            return 0
+        n = len(self.cache)
+        for lemma, pos in lemmas:
+            for key, form in self.forms(lemma, pos):
+                if self.cache.full():
+                    return len(self.cache) - n
+                if key not in self.cache:
+                    self.cache.put(key, form)
+        return len(self.cache) - n
+
+    # precompute the paradigms of the given (lemma, POS) pairs 
+    # and save them to a store that can be opened 
+    # with DERBI(model, paradigm_store=path)
+    def build_paradigm_store(self, path: str, lemmas):
+        Tools.ParadigmStore.build(path, (entry for lemma, pos in lemmas for entry in self.forms(lemma, pos)))
+
+    # transfer the casing of the original token to its inflected form
+    # (the characters beyond the length of the original token are left as they are)
+    @staticmethod
+    def transfer_case(inflected: str, original: str) -> str:
+        return ''.join([char.upper() if orig.isupper() else char.lower() 
+                        for char, orig in zip(inflected, original)]) + inflected[len(original):]
+
+    # replace the inflected tokens in the input text;
+    # the rest of the text (including whitespaces) is copied as is
+    # using the offsets of the tokens
     @classmethod
-    def get_delimitors(cls, text, tokens):
-        text_ = '' + text
-        delimitors = []
-        masks = []
-        for i in range(len(tokens) - 1):
-            pre = tokens[i]
-            post = tokens[i + 1]
-            text_ = re.sub(pre, '', text_, count=1)
-            delimitor = re.findall(f'.*?(?={post})', text_)[0]
-            delimitors.append(delimitor)
-            text_ = re.sub(delimitor, '', text_, count=1)
-            masks.append(cls.mask(pre))
-        delimitors.append('')
-        return delimitors, masks
-
-    def __call__(self, text: str, target_tags: dict or list=None, indices: int or list=0) -> str:
-        # check if the target tagsets and indices of to-be-inflected tokens were provided
+    def splice(cls, text: str, doc: spacy.tokens.Doc, results: dict) -> str:
+        pieces, start = [], 0
+        for i in sorted(results):
+            token = doc[i]
+            pieces.append(text[start:token.idx])
+            pieces.append(cls.transfer_case(results[i], token.text))
+            start = token.idx + len(token.text)
+        pieces.append(text[start:])
+        return ''.join(pieces)
+
+    # bring the input tagsets and indices to lists
+    @staticmethod
+    def coerce_args(target_tags: dict or list=None, indices: int or list=0) -> tuple:
         if isinstance(target_tags, dict):
 #             if not len(target_tags):
 #                 raise ValueError('At list one key-value pair required in target tags.')
             target_tags = [target_tags]
+        # if no tags were provided, nothing is to be inflected
         if target_tags is None:
-            warnings.warn('No tags were provided; none of the tokens will be inflected.', Warning)
-            return text
+            return None, indices
         # if no indices were provided, set default as 0
-        if isinstance(indices, int):
+        # (a single index of a wrong type is wrapped as well, so that it is reported as such)
+        if isinstance(indices, (int, str)) or not hasattr(indices, '__len__'):
             indices = [indices]
-        # check the correspondance of the tagsets and the indices
+        return target_tags, indices
+
+    # the same and check their correspondance
+    @classmethod
+    def check_args(cls, target_tags: dict or list=None, indices: int or list=0) -> tuple:
+        target_tags, indices = cls.coerce_args(target_tags, indices)
+        if (target_tags is not None) and (len(target_tags) != len(indices)):
+            raise ValueError(Tools.status_message(Tools.Status.ARGS_MISMATCH))
+        return target_tags, indices
+
+    # process the input tags of a token and inflect it;
+    # returns the processed tags and the result
+    def resolve(self, token: spacy.tokens.token.Token, tagset: dict) -> tuple:
+        if Tools.stats.enabled:
+            return self.timed_resolve(token, tagset)
+        target_tags = Tools.TagSet.of({}) if not len(tagset) else self.TagsProcessor.sub_tags(token, tagset)
+        # check if anything changed
+        if target_tags == str(token.morph):
+            return target_tags, token.text.lower()
+        return target_tags, self.inflect(token, target_tags)
+
+    # the same with the stages timed (see stats)
+    def timed_resolve(self, token: spacy.tokens.token.Token, tagset: dict) -> tuple:
+        with Tools.stats.timer('sub_tags'):
+            target_tags = Tools.TagSet.of({}) if not len(tagset) else self.TagsProcessor.sub_tags(token, tagset)
+        if target_tags == str(token.morph):
+            return target_tags, token.text.lower()
+        with Tools.stats.timer('inflect'):
+            result = self.inflect(token, target_tags)
+        Tools.stats.tick()
+        return target_tags, result
+
+    '''
+    Structured mode (structured=True in __call__ and pipe): instead of raising exceptions
+    and emitting warnings, DERBI returns a Tools.Result for each text and for each of its tokens:
+    the status (see Tools.Status), the result, the resolved tagset and the features set as default.
+    No message strings are built on this path (Result.message builds one when asked for),
+    and the tokens that could be inflected are inflected even if the others failed.
+    '''
+
+    # the same as resolve, but returns a Tools.Result
+    def resolve_result(self, token: spacy.tokens.token.Token, tagset: dict) -> Tools.Result:
+        Status = Tools.Status
+        try:
+            if not len(tagset):
+                status, target_tags, detail = Status.OK, Tools.TagSet.of({}), ()
+            else:
+                status, target_tags, detail = self.TagsProcessor.resolve_tags(token, tagset)
+                if status >= 10:
+                    return Tools.Result(status, target_tags=target_tags, detail=detail)
+            # check if anything changed
+            if target_tags == str(token.morph):
+                return Tools.Result(Status.UNCHANGED, token.text.lower(), target_tags)
+            if self.invalid_characters.search(token.norm_) is not None:
+                return Tools.Result(Status.SKIPPED_CHARACTERS, token.norm_, target_tags, detail=(token.norm_,))
+            if not len(target_tags):
+                return Tools.Result(Status.SKIPPED_NO_TAGS, token.norm_, target_tags, detail=(token.norm_,))
+            result = self.dispatch(token, target_tags)
+        except Exception as e:
+            return Tools.Result.from_exception(e)
+        defaults = None
+        if status == Status.DEFAULTS:
+            given = set(self.TagsProcessor.normalize_tags(tagset)) | set(self.TagsProcessor.normalize_tags(Tools.split_tags(str(token.morph))))
+            defaults = {cat: feat for cat, feat in target_tags.items() if cat not in given}
+        return Tools.Result(status, result, target_tags, defaults, detail)
+
+    # the same as process, but returns a Tools.Result for the text
+    def process_result(self, text: str, doc: spacy.tokens.Doc, target_tags: list, indices: list) -> Tools.Result:
+        Status = Tools.Status
+        if target_tags is None:
+            return Tools.Result(Status.NO_TAGS, text)
         if len(target_tags) != len(indices):
-            raise ValueError('Number of indices and number of target tagsets must not differ.')
+            return Tools.Result(Status.ARGS_MISMATCH)
+        try:
+            tokens = {}
+            for ind, tagset in zip(indices, target_tags):
+                if not isinstance(ind, int):
+                    tokens[ind] = Tools.Result(Status.BAD_REQUEST, detail=('Index must be an int, not ' + type(ind).__name__ + '.',))
+                elif not -len(doc) <= ind < len(doc):
+                    tokens[ind] = Tools.Result(Status.INDEX_OUT_OF_RANGE, detail=(ind, len(doc)))
+                else:
+                    tokens[ind] = self.resolve_result(doc[ind], tagset)
+                if Tools.stats.enabled:
+                    Tools.stats.count('results', tokens[ind].status.name)
+            # the text has the status of the first token that failed
+            failed = next((token for token in tokens.values() if not token.ok), None)
+            with Tools.stats.timer('reassembly'):
+                result = self.splice(text, doc, {doc[i].i: token.result for i, token in tokens.items() if token.ok})
+        except Exception as e:
+            return Tools.Result.from_exception(e)
+        if failed is None:
+            return Tools.Result(Status.OK, result, tokens=tokens)
+        return Tools.Result(failed.status, result, detail=failed.detail, tokens=tokens)
 
-        # process the input text with the given spaCy model
-        self.doc = self.model(text)
-        delimitors, masks = self.get_delimitors(text, [token.text for token in self.doc])
-
-        self.to_inflect = {
-            str(ind): {
-            'token': self.doc[ind],
-            'target_tags': '' if not len(tagset) else self.TagsProcessor.sub_tags(self.doc[ind], tagset)
-            } for ind, tagset in zip(indices, target_tags)}
+    # a text must be a string or a parsed Doc
+    @staticmethod
+    def check_text(text: str or spacy.tokens.Doc):
+        if not (isinstance(text, str) or is_doc(text)):
+            raise Tools.InflectionError(Tools.Status.BAD_REQUEST, 'Text must be a string or a spaCy Doc, not ' + type(text).__name__ + '.')
+
+    def structured_call(self, text: str or spacy.tokens.Doc, target_tags: dict or list=None, indices: int or list=0) -> Tools.Result:
+        try:
+            self.check_text(text)
+            target_tags, indices = self.coerce_args(target_tags, indices)
+            if is_doc(text):
+                return self.process_result(text.text, text, target_tags, indices)
+            if (target_tags is None) or (len(target_tags) != len(indices)):
+                return self.process_result(text, None, target_tags, indices)
+            with Tools.stats.timer('parse'):
+                doc = self.parse(text)
+        except Exception as e:
+            return Tools.Result.from_exception(e)
+        return self.process_result(text, doc, target_tags, indices)
+
+    # inflect the tokens of an already parsed text;
+    # returns the processed tags and the result for each index:
+    # {'index': {'token': ..., 'target_tags': ..., 'result': ...}, ...};
+    # no state is kept in the instance, so it can be used by many threads at once
+    def inflect_tokens(self, doc: spacy.tokens.Doc, target_tags: list, indices: list) -> dict:
+        to_inflect = {}
         # obtain the results for each token
-        for data in self.to_inflect.values():
-            # check if anything changed
-            if data['target_tags'] == str(data['token'].morph):
-                data['result'] = data['token'].text.lower()
-            else:
-                data['result'] = self.inflect(data['token'], data['target_tags'])
+        for ind, tagset in zip(indices, target_tags):
+            token = doc[ind]
+            resolved, result = self.resolve(token, tagset)
+            to_inflect[str(ind)] = {'token': token, 'target_tags': resolved, 'result': result}
+        return to_inflect
+
+    # inflect the tokens of an already parsed text and assemble the result
+    def process(self, text: str, doc: spacy.tokens.Doc, target_tags: list, indices: list) -> str:
+        if target_tags is None:
+            Tools.stats.count('warnings')
+            warnings.warn('No tags were provided; none of the tokens will be inflected.', Warning)
+            return text
+
+        to_inflect = self.inflect_tokens(doc, target_tags, indices)
         # assemble the result
-        result = ''
-        # self.result_text = ' '.join(
-        #     [word.text if self.to_inflect.get(str(i)) is None 
-        #      else self.to_inflect[str(i)]['result']
-        #      for i, word in enumerate(self.doc)
-        #     ])#.lower()
-        for i, word in enumerate(self.doc):
-            if self.to_inflect.get(str(i)) is None:
-                result += word.text
-            else:
-                inflected = self.to_inflect[str(i)]['result']
-                mask = masks[i]
-                remasked = self.remask(inflected, mask)
-                result += remasked
-            result += delimitors[i]
-        return result
\ No newline at end of file
+        with Tools.stats.timer('reassembly'):
+            return self.splice(text, doc, {data['token'].i: data['result'] for data in to_inflect.values()})
+
+    # the input can also be a spacy Doc that has already been parsed
+    # (with the same model or any other German pipeline);
+    # then it is not parsed again;
+    # with structured=True returns a Tools.Result and raises nothing (see structured mode above)
+    def __call__(self, text: str or spacy.tokens.Doc, target_tags: dict or list=None, indices: int or list=0,
+                 structured: bool=False) -> str or Tools.Result:
+        if structured:
+            return self.structured_call(text, target_tags, indices)
+        # check if the target tagsets and indices of to-be-inflected tokens were provided
+        target_tags, indices = self.check_args(target_tags, indices)
+        if is_doc(text):
+            return self.process(text.text, text, target_tags, indices)
+        if target_tags is None:
+            return self.process(text, None, target_tags, indices)
+        # process the input text with the given spaCy model
+        with Tools.stats.timer('parse'):
+            doc = self.parse(text)
+        return self.process(text, doc, target_tags, indices)
+
+    # inflect a word from its analysis instead of a parsed text, so no spaCy is needed:
+    # lemma and pos (UPOS) of the word, the target tags (as in __call__),
+    # morph, the features of the word ('Case=Nom|Number=Sing' or a dict; none by default) and
+    # text, the word itself (the lemma by default), the casing of which the result gets;
+    # returns the inflected word or, with structured=True, a Tools.Result
+    def inflect_lemma(self, lemma: str, pos: str, target_tags: dict, morph: str or dict=None, text: str=None,
+                      structured: bool=False) -> str or Tools.Result:
+        try:
+            if Router.get(pos.upper()) is None:
+                raise Tools.InflectionError(Tools.Status.BAD_REQUEST, 'Unknown POS "' + pos + '".')
+            token = Tools.TokenView(text if text is not None else lemma, lemma, pos, morph)
+        except Exception as e:
+            if structured:
+                return Tools.Result.from_exception(e)
+            raise
+        if structured:
+            result = self.resolve_result(token, target_tags or {})
+            if result.ok:
+                result.result = self.transfer_case(result.result, token.text)
+            return result
+        return self.transfer_case(self.resolve(token, target_tags or {})[1], token.text)
+
+    # requests must be hashable for us to be able to collapse the duplicates
+    @staticmethod
+    def request_key(text: str, target_tags: list, indices: list) -> tuple:
+        if target_tags is None:
+            return text, None, None
+        return text, tuple(tuple(sorted(tagset.items())) for tagset in target_tags), tuple(indices)
+
+    # batch version of __call__:
+    # takes an iterable of (text, target_tags, indices) triples 
+    # (text can be a parsed spacy Doc, as in __call__) and
+    # yields the results in the input order;
+    # the texts are parsed with spaCy batching (spacy.Language.pipe),
+    # duplicate requests within a batch are processed only once;
+    # with structured=True yields Tools.Results, and the invalid requests 
+    # do not affect the other ones
+    def pipe(self, items, batch_size: int=1000, n_process: int=1, structured: bool=False):
+        # batches that have been sent to spaCy but not yet yielded
+        pending = deque()
+
+        def texts():
+            items_iter = iter(items)
+            while True:
+                batch = list(islice(items_iter, batch_size))
+                if not len(batch):
+                    return
+                requests, keys = {}, []
+                for text, target_tags, indices in batch:
+                    if not structured:
+                        target_tags, indices = self.check_args(target_tags, indices)
+                        key = self.request_key(text, target_tags, indices)
+                    else:
+                        try:
+                            self.check_text(text)
+                            target_tags, indices = self.coerce_args(target_tags, indices)
+                            if (target_tags is not None) and (len(target_tags) != len(indices)):
+                                raise Tools.InflectionError(Tools.Status.ARGS_MISMATCH)
+                            key = self.request_key(text, target_tags, indices)
+                            # (a feature given as a list etc. makes the key unhashable)
+                            hash(key)
+                        except Exception as e:
+                            key = ('failed', len(keys))
+                            requests[key] = Tools.Result.from_exception(e)
+                            keys.append(key)
+                            continue
+                    requests[key] = (text, target_tags, indices)
+                    keys.append(key)
+                # only the texts that are to be inflected and have not been parsed 
+                # (and are not in the parse cache) need parsing;
+                # if there are none, we parse an empty string for the batch
+                # to still have a doc to be matched with
+                to_parse = list(dict.fromkeys(request[0] for request in requests.values() 
+                                              if isinstance(request, tuple) and (request[1] is not None) and isinstance(request[0], str)))
+                cached = {}
+                if self.parse_cache is not None:
+                    for text in to_parse:
+                        doc = self.parse_cache.get(text)
+                        if doc is not None:
+                            cached[text] = doc
+                    to_parse = [text for text in to_parse if text not in cached]
+                to_parse = to_parse or ['']
+                pending.append((requests, keys, to_parse, cached))
+                yield from to_parse
+
+        self.check_parser()
+        docs = iter(self.model.pipe(texts(), batch_size=batch_size, n_process=n_process))
+        for first in docs:
+            requests, keys, to_parse, parsed = pending.popleft()
+            for text, doc in zip(to_parse, chain([first], islice(docs, len(to_parse) - 1))):
+                parsed[text] = doc
+                if (self.parse_cache is not None) and text:
+                    self.parse_cache.put(text, doc)
+            results = {}
+            process = self.process_result if structured else self.process
+            for key, request in requests.items():
+                if isinstance(request, Tools.Result):
+                    results[key] = request
+                    continue
+                text, target_tags, indices = request
+                if is_doc(text):
+                    results[key] = process(text.text, text, target_tags, indices)
+                else:
+                    results[key] = process(text, parsed[text] if target_tags is not None else None, target_tags, indices)
+            for key in keys:
+                yield results[key]
+
+
+# DERBI as a spaCy pipeline component:
+#   nlp.add_pipe('derbi')
+#   doc = nlp('Der Hund läuft schnell')
+#   doc[1]._.inflect({'Number': 'Plur'})  # -> 'Hunde'
+# the component does not change the doc, it only makes DERBI available
+# to its tokens: inflection is run lazily when token._.inflect() is called;
+# the instance is not stored in the doc (its user data must stay serializable,
+# e.g. for nlp.pipe(n_process=...) and doc.to_bytes()), but found by the vocab of the doc
+components = {}
+
+class DERBIComponent:
+
+    def __init__(self, nlp: spacy.lang.de.German, cache_size: int=65536, paradigm_store: str=None, instrument: bool=False):
+        self.derbi = DERBI(nlp, cache_size=cache_size, paradigm_store=paradigm_store, instrument=instrument)
+        components[nlp.vocab] = self.derbi
+
+    def __call__(self, doc: spacy.tokens.Doc) -> spacy.tokens.Doc:
+        # (in the worker processes of nlp.pipe the component is a copy)
+        components[doc.vocab] = self.derbi
+        return doc
+
+
+def create_derbi_component(nlp: spacy.lang.de.German, name: str, cache_size: Optional[int], paradigm_store: Optional[str], 
+                           instrument: bool) -> DERBIComponent:
+    return DERBIComponent(nlp, cache_size, paradigm_store, instrument)
+
+
+# token._.inflect(target_tags): the same as DERBI.__call__ for a single token,
+# returns the inflected token (not the whole text)
+def inflect_token(token: spacy.tokens.token.Token, target_tags: dict) -> str:
+    derbi = components.get(token.doc.vocab)
+    if derbi is None:
+        raise ValueError('DERBI component is not in the pipeline; add it with nlp.add_pipe(\'derbi\').')
+    return derbi.transfer_case(derbi.resolve(token, target_tags)[1], token.text)
+
+
+# the component and the extensions are only registered if spaCy is available
+if spacy is not None:
+    Language.factory('derbi', default_config={'cache_size': 65536, 'paradigm_store': None, 'instrument': False},
+                     func=create_derbi_component)
+    if not spacy.tokens.Doc.has_extension('derbi'):
+        spacy.tokens.Doc.set_extension('derbi', getter=lambda doc: components.get(doc.vocab))
+    if not spacy.tokens.Token.has_extension('inflect'):
+        spacy.tokens.Token.set_extension('inflect', method=inflect_token)
+
+
+# DERBI.inflect_lemma without an instance: DERBI(None), 
+# which does not need spaCy, is created at the first call 
+default_derbi = None
+
+def inflect_lemma(lemma: str, pos: str, target_tags: dict, morph: str or dict=None, text: str=None,
+                  structured: bool=False) -> str or Tools.Result:
+    global default_derbi
+    if default_derbi is None:
+        default_derbi = DERBI(None)
+    return default_derbi.inflect_lemma(lemma, pos, target_tags, morph, text, structured)
@@ -0,0 +1,295 @@
+# Copyright 2022 Max Schmaltz: @maxschmaltz
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ************************************************************************
+
+import os, sys
+ROOT = os.path.dirname(__file__)
+sys.path.append(ROOT)
+
+# import required modules
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, time
+import argparse
+import asyncio
+import json
+import warnings
+# import spaCy
+import spacy
+# import required scripts
+from derbi import DERBI
+import Tools
+
+
+'''
+HTTP inflection service (standard library only):
+    python server.py --model de_core_news_sm --port 8080
+Endpoints:
+    POST /inflect   body: a request {"text": ..., "target_tags": ..., "indices": ...}
+                    (the arguments of DERBI.__call__) or a list of them;
+                    response: the structured result (see Tools.Result.as_dict)
+                    {"status": ..., "result": ..., ...} (a list for a list);
+    GET  /health    {"status": "ok"};
+    GET  /metrics   the counters of the service, DERBI.stats() and the caches.
+The requests are not processed one by one: the concurrent ones are gathered
+into micro-batches (until max_batch_size requests are collected or max_delay seconds
+passed since the first of them) and processed with DERBI.pipe (that is, with spaCy batching)
+on an executor, so that the event loop is never blocked; up to n_threads batches are processed at once.
+'''
+
+class MicroBatcher:
+
+    def __init__(self, derbi: DERBI, max_batch_size: int=64, max_delay: float=0.005, n_threads: int=1):
+        self.derbi = derbi
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.n_threads = n_threads
+        self.executor = ThreadPoolExecutor(n_threads)
+        self.queue = None
+        self.semaphore = None
+        self.task = None
+        # the batches being processed
+        self.batches = set()
+        self.counters = {'requests': 0, 'batches': 0, 'failed_batches': 0, 'errors': 0, 'latency_total_ms': 0.0, 'latency_max_ms': 0.0}
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.semaphore = asyncio.Semaphore(self.n_threads)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        # the batches being processed are finished
+        await asyncio.gather(*self.batches, return_exceptions=True)
+        self.executor.shutdown()
+
+    # the result of a request or the exception it raised
+    async def submit(self, request: tuple):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((request, future, perf_counter()))
+        return await future
+
+    # collect a batch: wait for the first request, then for more of them
+    # until the batch is full or its latency budget is spent
+    async def collect(self) -> list:
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    # each batch is processed in its own task; a batch is only collected when a thread is free,
+    # so the requests that come meanwhile are gathered into the next batch
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.semaphore.acquire()
+            try:
+                batch = await self.collect()
+            except BaseException:
+                self.semaphore.release()
+                raise
+            task = loop.create_task(self.dispatch(batch))
+            self.batches.add(task)
+            task.add_done_callback(self.batches.discard)
+
+    # process a batch and resolve its futures; if anything fails,
+    # the requests of the batch get the exception and the other batches are not affected
+    async def dispatch(self, batch: list):
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, self.process, [request for request, _, _ in batch])
+            now = perf_counter()
+            self.counters['batches'] += 1
+            for (_, future, start), result in zip(batch, results):
+                latency = (now - start) * 1000
+                self.counters['requests'] += 1
+                self.counters['latency_total_ms'] += latency
+                self.counters['latency_max_ms'] = max(self.counters['latency_max_ms'], latency)
+                if not result.ok:
+                    self.counters['errors'] += 1
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            self.counters['failed_batches'] += 1
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.semaphore.release()
+
+    # runs on the executor; the results are structured (see DERBI.__call__),
+    # so an invalid request only affects itself; if the batch cannot be parsed,
+    # the requests are processed one by one
+    def process(self, requests: list) -> list:
+        try:
+            return list(self.derbi.pipe(requests, batch_size=len(requests), structured=True))
+        except Exception:
+            return [self.derbi(*request, structured=True) for request in requests]
+
+    def metrics(self) -> dict:
+        counters = dict(self.counters)
+        counters['mean_batch_size'] = round(counters['requests'] / counters['batches'], 2) if counters['batches'] else 0.0
+        counters['latency_mean_ms'] = round(counters['latency_total_ms'] / counters['requests'], 3) if counters['requests'] else 0.0
+        counters['queued'] = self.queue.qsize() if self.queue is not None else 0
+        return counters
+
+
+class InflectionServer:
+
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 413: 'Payload Too Large'}
+
+    def __init__(self, derbi: DERBI, max_batch_size: int=64, max_delay: float=0.005, n_threads: int=1,
+                 max_body_size: int=1 << 20):
+        self.derbi = derbi
+        self.batcher = MicroBatcher(derbi, max_batch_size, max_delay, n_threads)
+        self.max_body_size = max_body_size
+        self.started = time()
+
+    @staticmethod
+    def error(e: Exception) -> dict:
+        return {'error': {'type': type(e).__name__, 'message': str(e)}}
+
+    # the length of the body or None if Content-Length is not a valid length
+    @staticmethod
+    def content_length(headers: dict) -> int or None:
+        try:
+            length = int(headers.get('content-length', 0) or 0)
+        except ValueError:
+            return
+        return length if length >= 0 else None
+
+    @staticmethod
+    def parse_request(request) -> tuple:
+        if not isinstance(request, dict):
+            raise ValueError('Request must be a JSON object.')
+        if not isinstance(request.get('text'), str):
+            raise ValueError('Request must contain "text" (a string).')
+        return request['text'], request.get('target_tags'), request.get('indices', 0)
+
+    async def inflect(self, request) -> dict:
+        try:
+            request = self.parse_request(request)
+        except Exception as e:
+            return {'status': 'BAD_REQUEST', 'result': None, 'message': str(e)}
+        # the batch of the request failed as a whole (see MicroBatcher.dispatch)
+        try:
+            return (await self.batcher.submit(request)).as_dict()
+        except Exception as e:
+            return Tools.Result.from_exception(e).as_dict()
+
+    async def route(self, method: str, path: str, body: bytes) -> tuple:
+        if path == '/health':
+            return 200, {'status': 'ok', 'uptime_s': round(time() - self.started, 1)}
+        if path == '/metrics':
+            return 200, {'service': self.batcher.metrics(), 'derbi': self.derbi.stats()}
+        if path != '/inflect':
+            return 404, {'error': {'type': 'NotFound', 'message': 'Unknown path "' + path + '".'}}
+        if method != 'POST':
+            return 405, {'error': {'type': 'MethodNotAllowed', 'message': 'Use POST for /inflect.'}}
+        try:
+            payload = json.loads(body)
+        except ValueError as e:
+            return 400, self.error(e)
+        # a list of requests is split, so that its items join the micro-batches as the single ones do
+        if isinstance(payload, list):
+            return 200, list(await asyncio.gather(*[self.inflect(request) for request in payload]))
+        return 200, await self.inflect(payload)
+
+    # minimal HTTP/1.1 with keep-alive
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = (request_line.decode('latin-1').split() + ['', '', ''])[:3]
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = self.content_length(headers)
+                # the body cannot be skipped without its length, so the connection is closed
+                if length is None:
+                    status, payload = 400, {'error': {'type': 'BadRequest', 'message': 'Invalid Content-Length.'}}
+                    keep_alive = False
+                elif length > self.max_body_size:
+                    status, payload = 413, {'error': {'type': 'PayloadTooLarge', 'message': 'Body exceeds ' + str(self.max_body_size) + ' bytes.'}}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(length) if length else b''
+                    status, payload = await self.route(method, path.split('?')[0], body)
+                    keep_alive = (headers.get('connection', '').lower() != 'close') and (version != 'HTTP/1.0')
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                writer.write(('HTTP/1.1 ' + str(status) + ' ' + self.reasons[status] + '\r\n'
+                              'Content-Type: application/json; charset=utf-8\r\n'
+                              'Content-Length: ' + str(len(data)) + '\r\n'
+                              'Connection: ' + ('keep-alive' if keep_alive else 'close') + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str='127.0.0.1', port: int=8080):
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+def main(argv: list=None):
+    parser = argparse.ArgumentParser(description='DERBI HTTP inflection service.')
+    parser.add_argument('-m', '--model', default='de_core_news_sm', help='German spaCy pipeline')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch-size', type=int, default=64, help='maximal number of requests in a micro-batch')
+    parser.add_argument('--max-delay-ms', type=float, default=5.0, help='latency budget of a micro-batch')
+    parser.add_argument('--threads', type=int, default=1, help='threads the batches are processed in')
+    parser.add_argument('--cache-size', type=int, default=65536)
+    parser.add_argument('--parse-cache-size', type=int, default=0)
+    parser.add_argument('--instrument', action='store_true', help='collect DERBI counters and timings for /metrics')
+    parser.add_argument('--warnings', action='store_true', help='show DERBI warnings')
+    parser.add_argument('--full-pipeline', action='store_true', help='load all the components of the model (parser, ner, vectors)')
+    args = parser.parse_args(argv)
+
+    if not args.warnings:
+        warnings.simplefilter('ignore')
+    kwargs = {'cache_size': args.cache_size, 'parse_cache_size': args.parse_cache_size, 'instrument': args.instrument}
+    # only the components DERBI needs are loaded (see DERBI.from_name)
+    derbi = DERBI(spacy.load(args.model), **kwargs) if args.full_pipeline else DERBI.from_name(args.model, **kwargs)
+    server = InflectionServer(derbi, args.max_batch_size, args.max_delay_ms / 1000, args.threads)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
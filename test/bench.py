@@ -0,0 +1,261 @@
+import spacy
+
+# import requred packages
+from collections import defaultdict
+from time import perf_counter
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import re
+# we will ignore warnings
+import warnings
+warnings.simplefilter('ignore')
+
+'''
+Throughput benchmark.
+The corpus is built from the shipped data only (no downloads, no treebanks):
+the words are the lemmas of the lexicons and the target tags are the tagsets
+of LabelsScheme that agree with their lexicon rules, both sampled with a fixed seed,
+so the corpus is the same on every run.
+Each request is processed with DERBI.__call__; we measure tokens per second
+and the latency of the calls, and the time of each stage of the processing:
+    parse       spaCy parse of the text;
+    sub_tags    processing of the target tags (TagsProcessor.sub_tags);
+    lexicon     search in the lexicons (search_in_lexicon of the inflectors);
+    automata    regular model (automata of the inflectors);
+    inflect     the rest of the inflection (redirection, caches, inflectors logic);
+    reassembly  assembling the output text (DERBI.splice);
+    other       everything else (argument checks etc.).
+The stages are timed exclusively: the time of a nested stage (e.g. lexicon inside inflect)
+is not counted in the outer one.
+The results can be saved as a baseline; the next runs are compared with it.
+'''
+
+# POS the corpus words are taken from (the ones with lexicons)
+corpus_pos = ['ADJ', 'ADP', 'ADV', 'AUX', 'DET', 'NOUN', 'PRON', 'VERB']
+
+baseline_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bench_baseline.json')
+
+
+def build_corpus(derbi_module, n_requests: int=2000, words_per_text: int=6, seed: int=42) -> list:
+    Tools = derbi_module.Tools
+    rnd = random.Random(seed)
+    rules, tagsets = {}, {}
+    for pos in corpus_pos:
+        lexc_path = derbi_module.Router[pos][2]
+        if (lexc_path is None) or (not os.path.exists(Tools.package_path(lexc_path))):
+            continue
+        lexicon = Tools.load_rules(Tools.Lexicon, lexc_path)
+        words = sorted([lemma for lemma in lexicon if re.fullmatch('[a-zäöüß]+', lemma)])
+        if len(words) and len(Tools.LabelsScheme.get(pos, [])):
+            rules[pos] = [(word, lexicon[word]) for word in words]
+            tagsets[pos] = [Tools.split_tags(tagset) for tagset in Tools.LabelsScheme[pos]]
+    filter = Tools.TagsProcessor().filter
+    all_pos = sorted(rules)
+
+    corpus = []
+    for _ in range(n_requests):
+        words, target_tags, indices = [], [], []
+        for i in range(words_per_text):
+            pos = rnd.choice(all_pos)
+            word, word_rules = rnd.choice(rules[pos])
+            words.append(word.capitalize() if pos == 'NOUN' else word)
+            # a tagset of the labels scheme that agrees with the conditions 
+            # of one of the lexicon rules of the word, so that it is applicable
+            conditions = rnd.choice(word_rules)['rule']
+            candidates = [tagset for tagset in tagsets[pos] if all([tagset[cat] in feats 
+                          for cat, feats in conditions.items() if cat in tagset])]
+            if not len(candidates):
+                continue
+            # the categories that cannot be alternated are not requested
+            tags = {cat: feat for cat, feat in rnd.choice(candidates).items() if cat not in filter.get(pos, [])}
+            if len(tags):
+                target_tags.append(tags)
+                indices.append(i)
+        corpus.append((' '.join(words), target_tags, indices))
+    return corpus
+
+def corpus_fingerprint(corpus: list) -> str:
+    return hashlib.sha1(json.dumps(corpus, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+# nearest-rank percentile
+def percentile(values: list, p: float) -> float:
+    if not len(values):
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+# exclusive timing of nested stages
+class StageTimer:
+
+    def __init__(self):
+        self.current = defaultdict(float)
+        self.stack = []
+
+    def wrap(self, stage: str, func):
+        def timed(*args, **kwargs):
+            self.stack.append(0.0)
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = perf_counter() - start
+                inner = self.stack.pop()
+                self.current[stage] += elapsed - inner
+                if len(self.stack):
+                    self.stack[-1] += elapsed
+        return timed
+
+    def reset(self) -> dict:
+        current, self.current = self.current, defaultdict(float)
+        return current
+
+
+# the model is only called, the rest of its attributes are passed through
+class TimedModel:
+
+    def __init__(self, model, timer: StageTimer):
+        self.model = model
+        self.parse = timer.wrap('parse', model)
+
+    def __call__(self, text: str) -> spacy.tokens.Doc:
+        return self.parse(text)
+
+    def __getattr__(self, name: str):
+        return getattr(self.model, name)
+
+
+class Benchmark:
+
+    stages = ['parse', 'sub_tags', 'lexicon', 'automata', 'inflect', 'reassembly', 'other']
+
+    def __init__(self, derbi, derbi_module, corpus: list):
+        self.derbi = derbi
+        self.derbi_module = derbi_module
+        self.corpus = corpus
+
+    # instrument the instance and the inflectors;
+    # returns the function that removes the instrumentation
+    def instrument(self, timer: StageTimer):
+        derbi, Inflectors = self.derbi, self.derbi_module.Inflectors
+        # all the inflectors must exist before they are instrumented
+        for pos in self.derbi_module.Router:
+            getattr(derbi, pos.lower() + '_inflector')
+        inflectors = list(Inflectors.loaded_inflectors.values())
+        model = derbi.model
+        derbi.model = TimedModel(model, timer)
+        derbi.TagsProcessor.sub_tags = timer.wrap('sub_tags', derbi.TagsProcessor.sub_tags)
+        derbi.dispatch = timer.wrap('inflect', derbi.dispatch)
+        derbi.splice = timer.wrap('reassembly', derbi.splice)
+        for inflector in inflectors:
+            inflector.search_in_lexicon = timer.wrap('lexicon', inflector.search_in_lexicon)
+            inflector.automata = timer.wrap('automata', inflector.automata)
+
+        def restore():
+            derbi.model = model
+            for obj, names in [(derbi.TagsProcessor, ['sub_tags']), (derbi, ['dispatch', 'splice'])] + \
+                              [(inflector, ['search_in_lexicon', 'automata']) for inflector in inflectors]:
+                for name in names:
+                    obj.__dict__.pop(name, None)
+        return restore
+
+    def __call__(self, n_warmup: int=100) -> dict:
+        # load everything needed first
+        for request in self.corpus[:n_warmup]:
+            try:
+                self.derbi(*request)
+            except Exception:
+                pass
+
+        timer = StageTimer()
+        restore = self.instrument(timer)
+        latencies, stage_times, n_tokens, errors = [], defaultdict(list), 0, 0
+        try:
+            start = perf_counter()
+            for request in self.corpus:
+                call_start = perf_counter()
+                try:
+                    self.derbi(*request)
+                except Exception:
+                    errors += 1
+                latency = perf_counter() - call_start
+                latencies.append(latency)
+                current = timer.reset()
+                current['other'] = max(0.0, latency - sum(current.values()))
+                for stage in self.stages:
+                    stage_times[stage].append(current.get(stage, 0.0))
+                n_tokens += len(request[0].split())
+            total = perf_counter() - start
+        finally:
+            restore()
+
+        ms = lambda s: round(s * 1000, 4)
+        return {
+            'corpus': corpus_fingerprint(self.corpus),
+            'requests': len(self.corpus),
+            'tokens': n_tokens,
+            'errors': errors,
+            'seconds': round(total, 3),
+            'tokens_per_sec': round(n_tokens / total, 1),
+            'latency_ms': {'p50': ms(percentile(latencies, 50)), 'p99': ms(percentile(latencies, 99))},
+            'stages_ms': {stage: {'total': ms(sum(times)), 'p50': ms(percentile(times, 50)), 'p99': ms(percentile(times, 99))}
+                          for stage, times in stage_times.items()}
+            }
+
+
+# compare a report with the baseline: a throughput drop or a latency growth
+# of more than tolerance is a regression
+def compare(report: dict, baseline: dict, tolerance: float=0.1) -> list:
+    if report['corpus'] != baseline['corpus']:
+        warnings.warn('The corpus differs from the baseline one; the comparison is not meaningful.', Warning)
+    regressions = []
+    ratio = report['tokens_per_sec'] / baseline['tokens_per_sec']
+    print('tokens/sec'.ljust(24), baseline['tokens_per_sec'], '->', report['tokens_per_sec'], '(x' + str(round(ratio, 2)) + ')')
+    if ratio < 1 - tolerance:
+        regressions.append('tokens_per_sec')
+    rows = [('latency ' + p, baseline['latency_ms'][p], report['latency_ms'][p]) for p in ['p50', 'p99']]
+    rows += [(stage + ' ' + p, baseline['stages_ms'][stage][p], report['stages_ms'][stage][p])
+             for stage in Benchmark.stages if stage in baseline['stages_ms'] for p in ['p50', 'p99']]
+    for name, before, after in rows:
+        ratio = after / before if before else 1.0
+        print((name + ' ms').ljust(24), before, '->', after, '(x' + str(round(ratio, 2)) + ')')
+        # the stages are only reported, SLOs are defined for the calls
+        if name.startswith('latency') and (ratio > 1 + tolerance):
+            regressions.append(name)
+    return regressions
+
+
+def main(model_name: str='de_core_news_sm', n_requests: int=2000, seed: int=42, cache_size: int=0,
+         baseline: str=baseline_path, save_baseline: bool=False, tolerance: float=0.1):
+    from DERBI import derbi as derbi_module
+    # no cache by default, so that every call goes through the rules
+    derbi = derbi_module.DERBI(spacy.load(model_name), cache_size=cache_size)
+    report = Benchmark(derbi, derbi_module, build_corpus(derbi_module, n_requests, seed=seed))()
+    report['model'] = model_name
+    print(json.dumps(report, indent=4))
+
+    if save_baseline:
+        with open(baseline, 'w') as f:
+            json.dump(report, f, indent=4)
+        return report
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            regressions = compare(report, json.load(f), tolerance)
+        assert not len(regressions), 'Regressions: ' + ', '.join(regressions)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='DERBI throughput benchmark.')
+    parser.add_argument('--model', default='de_core_news_sm')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--cache-size', type=int, default=0)
+    parser.add_argument('--baseline', default=baseline_path)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    main(args.model, args.requests, args.seed, args.cache_size, args.baseline, args.save_baseline, args.tolerance)
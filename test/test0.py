@@ -26,12 +26,17 @@ from DERBI.Tools import split_tags
 # import requred packages
 from tqdm import tqdm
 from numpy import floor
+import hashlib
+import json
+import multiprocessing
+import os
 import re
 # we will ignore warnings
 import warnings
 warnings.simplefilter('ignore')
 
 from collections import defaultdict
+from spacy.tokens import DocBin
 
 '''
 For evaluation we use 'de_lit-ud-test.txt' from 
@@ -167,8 +172,7 @@ class DerbiTest:
             have Case, Gender, ...)
             '''
             try:
-                _ = self.derbi(window, tags_dict, ind)
-                pred = self.derbi.to_inflect[str(ind)].get('result')
+                pred = self.derbi.inflect_tokens(self.model(window), [tags_dict], [ind])[str(ind)]['result']
             except Exception as e:
                 self.exceptions[type(e).__name__].append(e)
                 continue
@@ -182,46 +186,125 @@ class DerbiTest:
                 success[pos][0] += 1
             success[pos][1] += 1
         
+        return self.summarize(success)
+
+    @staticmethod
+    def summarize(success: dict) -> dict:
         return {
             'summary': (sum([s[0] for s in success.values()]), sum([s[1] for s in success.values()]), 
                         round(sum([s[0] for s in success.values()]) / sum([s[1] for s in success.values()]), 3)),
             'scores': {k: (s[0], s[1], round(s[0] / s[1], 3)) for k, s in success.items()}
             }
 
-    def __call__(self, text_path: str) -> dict:
+    '''
+    Parallel evaluation mode.
+    The test data and the windows are parsed once per model (the windows with nlp.pipe)
+    and cached in cache_dir: the test data as .json, the parsed windows as DocBin (.spacy);
+    the cache files are named after the model and the hash of the text, 
+    so the next runs (e.g. after a change of the rules) do not parse anything.
+    Then the windows are split into chunks and inflected in a pool of processes
+    (forked, so that the workers share the model, DERBI and the parsed windows 
+    and do not load them again); the per-POS scores of the chunks are merged.
+    '''
+    def cache_name(self, text: str) -> str:
+        model_name = self.model.meta.get('lang', 'de') + '_' + self.model.meta.get('name', 'model') + '-' + self.model.meta.get('version', '')
+        return model_name + '-' + hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+    def load_or_parse(self, text: str, cache_dir: str=None, batch_size: int=256) -> tuple:
+        data_path, docs_path = None, None
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            name = self.cache_name(text)
+            data_path, docs_path = os.path.join(cache_dir, name + '.json'), os.path.join(cache_dir, name + '.spacy')
+            if os.path.exists(data_path) and os.path.exists(docs_path):
+                with open(data_path) as f:
+                    test_data = [tuple(item) for item in json.load(f)]
+                docs = list(DocBin().from_disk(docs_path).get_docs(self.model.vocab))
+                return test_data, docs
+
+        test_data = self.get_test_data(self.model, text)
+        docs = list(tqdm(self.model.pipe([window for _, window, _, _, _ in test_data], batch_size=batch_size), total=len(test_data)))
+        if cache_dir is not None:
+            with open(data_path, 'w') as f:
+                json.dump(test_data, f, ensure_ascii=False)
+            DocBin(docs=docs).to_disk(docs_path)
+        return test_data, docs
+
+    def test_parallel(self, test_data: list, docs: list, n_process: int=1) -> dict:
+        global worker_state
+        worker_state = (self.derbi, docs, test_data)
+        n_chunks = max(1, n_process * 4)
+        chunks = [(i * len(test_data) // n_chunks, (i + 1) * len(test_data) // n_chunks) for i in range(n_chunks)]
+        if (n_process > 1) and ('fork' in multiprocessing.get_all_start_methods()):
+            with multiprocessing.get_context('fork').Pool(n_process) as pool:
+                results = list(tqdm(pool.imap(evaluate_chunk, chunks), total=len(chunks)))
+        else:
+            results = [evaluate_chunk(chunk) for chunk in tqdm(chunks)]
+        worker_state = None
+
+        # merge the chunks
+        success, self.exceptions = {}, defaultdict(list)
+        for chunk_success, chunk_exceptions in results:
+            for pos, (hits, total) in chunk_success.items():
+                success.setdefault(pos, [0, 0, 0])
+                success[pos][0] += hits
+                success[pos][1] += total
+            for name, messages in chunk_exceptions.items():
+                self.exceptions[name].extend(messages)
+        return self.summarize(success)
+
+    def __call__(self, text_path: str, n_process: int=1, cache_dir: str=None) -> dict:
         with open(text_path) as test_file:
             test_text = test_file.read().replace('\n', ' ')
 
-        test_data = self.get_test_data(self.model, test_text)
-        self.scores = self.test(test_data)
+        if (n_process == 1) and (cache_dir is None):
+            test_data = self.get_test_data(self.model, test_text)
+            self.scores = self.test(test_data)
+        else:
+            test_data, docs = self.load_or_parse(test_text, cache_dir)
+            self.scores = self.test_parallel(test_data, docs, n_process)
         return self.scores
 
+
+# (DERBI, parsed windows, test data) for the workers of DerbiTest.test_parallel
+worker_state = None
+
+# evaluate the windows [begin, end); returns {pos: (hits, total)} and 
+# {exception name: [messages]} (the exceptions themselves are not always picklable)
+def evaluate_chunk(chunk: tuple) -> tuple:
+    derbi, docs, test_data = worker_state
+    begin, end = chunk
+    success, exceptions = defaultdict(lambda: [0, 0]), defaultdict(list)
+    for doc, (ans, window, ind, tags_dict, pos) in zip(docs[begin: end], test_data[begin: end]):
+        try:
+            pred = derbi.inflect_tokens(doc, [tags_dict], [ind])[str(ind)]['result']
+        except Exception as e:
+            exceptions[type(e).__name__].append(str(e))
+            continue
+        if pred.strip() == ans.strip():
+            success[pos][0] += 1
+        success[pos][1] += 1
+    return dict(success), dict(exceptions)
+
     
-def main():
+def main(n_process: int=1, cache_dir: str=None):
     path = 'DERBI/test/UDGermanTreebanks/de_lit-ud-test.txt'
 
-    test_lg = DerbiTest(nlp_lg)
-    test_sm = DerbiTest(nlp_sm)
-    test_md = DerbiTest(nlp_md)
-
-    print('de_core_news_lg...', end='\n\n')
-    print(test_lg(path))
-    for key, exc in test_lg.exceptions.items():
-        print(key, len(exc))
-    print('\n\n\n')
-    print('de_core_news_sm...', end='\n\n')
-    print(test_sm(path))
-    for key, exc in test_sm.exceptions.items():
-        print(key, len(exc))
-    print('\n\n\n')
-    print('de_core_news_md...', end='\n\n')
-    print(test_md(path))
-    for key, exc in test_md.exceptions.items():
-        print(key, len(exc))
+    for name, nlp in [('de_core_news_lg', nlp_lg), ('de_core_news_sm', nlp_sm), ('de_core_news_md', nlp_md)]:
+        test = DerbiTest(nlp)
+        print(name + '...', end='\n\n')
+        print(test(path, n_process, cache_dir))
+        for key, exc in test.exceptions.items():
+            print(key, len(exc))
+        print('\n\n\n')
 
 if __name__ == '__main__':
-    main()
+    # e.g. python test0.py 8 .derbi_test_cache for 8 processes and a parse cache
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1, sys.argv[2] if len(sys.argv) > 2 else None)
+
 
+# reference output of main() on de_lit-ud-test.txt (the serial DerbiTest.test run);
+# the scores of a run in the parallel mode must be the same
 
 # de_core_news_lg...
 
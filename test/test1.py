@@ -0,0 +1,87 @@
+import spacy
+
+# import requred packages
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import random
+# we will ignore warnings
+import warnings
+warnings.simplefilter('ignore')
+
+'''
+Concurrency stress test.
+One DERBI instance (with one model and one set of rules)
+is shared by a pool of threads. Each request is called many
+times in random order; the results of the concurrent calls
+must not differ from the results of the serial ones.
+We also call DERBI with the same parsed docs from all the threads
+and make sure the docs are not modified.
+'''
+
+requests = [
+    ('DERBI sein machen, damit es all Entwickler ein Möglichkeit geben, jedes deutsche Wort automatisch zu beugen',
+     [{'Number': 'Sing', 'Person': '3', 'Verbform': 'Fin'}, {'Verbform': 'Part'}, {'Case': 'Dat', 'Number': 'Plur'},
+      {'Case': 'Dat', 'Number': 'Plur'}, {'Gender': 'Fem'}, {'Number': 'Sing', 'Person': '3', 'Verbform': 'Fin'},
+      {'Case': 'Acc', 'Number': 'Plur'}, {'Case': 'Acc', 'Declination': 'Weak', 'Number': 'Plur'}, {'Case': 'Acc', 'Number': 'Plur'}],
+     [1, 2, 6, 7, 8, 10, 12, 13, 14]),
+    ('Der schnelle Hund läuft über die Straße.', [{'Number': 'Plur'}, {'Number': 'Plur'}, {'Number': 'Plur'}], [0, 2, 3]),
+    ('Ich habe das rote Auto gesehen.', [{'Person': '3'}, {'Case': 'Dat'}, {'Degree': 'Cmp'}], [0, 2, 3]),
+    ('Die Kinder spielen im Kindergarten.', [{'Number': 'Sing'}, {'Tense': 'Past'}, {'Number': 'Plur'}], [1, 2, 4]),
+    ('Er kommt morgen an.', {'Tense': 'Past'}, 1),
+    ('Wir wollen schnell nach Hause gehen.', [{'Person': '2'}, {'Degree': 'Sup'}], [1, 2]),
+    ('Meine Mutter liest ein gutes Buch.', [{'Case': 'Dat'}, {'Case': 'Dat'}, {'Case': 'Gen'}, {'Case': 'Gen'}], [0, 1, 4, 5])
+]
+
+
+class ConcurrencyTest:
+
+    def __init__(self, derbi, requests: list=requests):
+        self.derbi = derbi
+        self.requests = requests
+
+    # we compare the results and the types of the exceptions
+    def call(self, request: tuple) -> str:
+        try:
+            return self.derbi(*request)
+        except Exception as e:
+            return type(e).__name__
+
+    @staticmethod
+    def snapshot(doc: spacy.tokens.Doc) -> list:
+        return [(t.text, t.lemma_, t.pos_, str(t.morph)) for t in doc]
+
+    def __call__(self, n_threads: int=16, n_rounds: int=50, seed: int=42) -> dict:
+        expected = [self.call(request) for request in self.requests]
+
+        # 1. raw texts
+        order = list(range(len(self.requests))) * n_rounds
+        random.Random(seed).shuffle(order)
+        with ThreadPoolExecutor(n_threads) as pool:
+            results = list(pool.map(lambda i: self.call(self.requests[i]), order))
+        mismatches = Counter(i for i, result in zip(order, results) if result != expected[i])
+
+        # 2. the same parsed docs for all the threads
+        docs = [self.derbi.model(text) for text, _, _ in self.requests]
+        before = [self.snapshot(doc) for doc in docs]
+        with ThreadPoolExecutor(n_threads) as pool:
+            doc_results = list(pool.map(lambda i: self.call((docs[i],) + self.requests[i][1:]), order))
+        mismatches.update(i for i, result in zip(order, doc_results) if result != expected[i])
+        modified = [i for i, doc in enumerate(docs) if self.snapshot(doc) != before[i]]
+
+        return {
+            'calls': 2 * len(order),
+            'mismatches': {self.requests[i][0]: n for i, n in mismatches.items()},
+            'modified_docs': [self.requests[i][0] for i in modified]
+            }
+
+
+def main(model_name: str='de_core_news_sm', n_threads: int=16, n_rounds: int=50):
+    from DERBI.derbi import DERBI
+    # no cache, so that every call goes through the rules
+    derbi = DERBI(spacy.load(model_name), cache_size=0)
+    report = ConcurrencyTest(derbi)(n_threads, n_rounds)
+    print(report)
+    assert not len(report['mismatches']) and not len(report['modified_docs'])
+
+if __name__ == '__main__':
+    main()
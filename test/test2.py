@@ -0,0 +1,86 @@
+import spacy
+
+# import requred packages
+import pickle
+# we will ignore warnings
+import warnings
+warnings.simplefilter('ignore')
+
+'''
+Serialization test.
+DERBI as a spaCy pipeline component must not prevent the docs
+from being serialized: the docs of nlp.pipe(n_process=2)
+(which are sent between the processes) must be inflected the same way
+as the ones of a single process, and a doc must survive doc.to_bytes()
+and DocBin(store_user_data=True) with token._.inflect() still working.
+A DERBI instance with its caches and the pipeline with the component
+must survive pickling (e.g. to be sent to another process).
+'''
+
+texts = [
+    'Der schnelle Hund läuft über die Straße.',
+    'Ich habe das rote Auto gesehen.',
+    'Die Kinder spielen im Kindergarten.',
+    'Meine Mutter liest ein gutes Buch.'
+]
+
+# token index -> target tags
+requests = {0: {'Number': 'Plur'}, 1: {'Case': 'Dat'}, 2: {'Number': 'Plur'}}
+
+
+class SerializationTest:
+
+    def __init__(self, nlp, texts: list=texts, requests: dict=requests):
+        self.nlp = nlp
+        self.texts = texts
+        self.requests = requests
+
+    # we compare the results and the types of the exceptions
+    def inflect(self, doc: spacy.tokens.Doc) -> list:
+        results = []
+        for i, target_tags in self.requests.items():
+            try:
+                results.append(doc[i]._.inflect(target_tags))
+            except Exception as e:
+                results.append(type(e).__name__)
+        return results
+
+    @staticmethod
+    def call(derbi, request: tuple) -> str:
+        try:
+            return derbi(*request)
+        except Exception as e:
+            return type(e).__name__
+
+    def __call__(self) -> dict:
+        expected = [self.inflect(doc) for doc in self.nlp.pipe(self.texts)]
+        report = {}
+        # 1. docs from the worker processes
+        report['n_process'] = [self.inflect(doc) for doc in self.nlp.pipe(self.texts, n_process=2)] == expected
+        # 2. serialized docs
+        docs = [spacy.tokens.Doc(self.nlp.vocab).from_bytes(doc.to_bytes()) for doc in self.nlp.pipe(self.texts)]
+        report['to_bytes'] = [self.inflect(doc) for doc in docs] == expected
+        doc_bin = spacy.tokens.DocBin(docs=list(self.nlp.pipe(self.texts)), store_user_data=True)
+        docs = spacy.tokens.DocBin().from_bytes(doc_bin.to_bytes()).get_docs(self.nlp.vocab)
+        report['doc_bin'] = [self.inflect(doc) for doc in docs] == expected
+        # 3. pickled instance (with filled caches) and pipeline
+        derbi = self.nlp.get_pipe('derbi').derbi
+        calls = [(text, target_tags, i) for text in self.texts for i, target_tags in self.requests.items()]
+        expected_calls = [self.call(derbi, call) for call in calls]
+        restored = pickle.loads(pickle.dumps(derbi))
+        report['pickle'] = [self.call(restored, call) for call in calls] == expected_calls
+        nlp = pickle.loads(pickle.dumps(self.nlp))
+        report['pickle_nlp'] = [self.inflect(doc) for doc in nlp.pipe(self.texts)] == expected
+        return report
+
+
+def main(model_name: str='de_core_news_sm'):
+    from DERBI import derbi
+    nlp = spacy.load(model_name)
+    nlp.add_pipe('derbi', config={'cache_size': 1024})
+    report = SerializationTest(nlp)()
+    print(report)
+    assert all(report.values())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+import spacy
+
+# import requred packages
+# we will ignore warnings
+import warnings
+warnings.simplefilter('ignore')
+
+'''
+Structured mode test.
+A stream of valid and invalid requests goes through DERBI.pipe(structured=True):
+there must be one result per request, in the input order;
+the valid requests must get the same results as one by one
+(structured __call__), and every invalid one must fail with its own status
+without affecting the others (a text that is not a string, an index
+that is not an int or is out of range, mismatching arguments etc.).
+'''
+
+# (request, expected status): the valid requests (None) must get the same results
+# as one by one, the invalid ones are mixed in between them
+stream = [
+    (('Der schnelle Hund läuft über die Straße.', [{'Number': 'Plur'}, {'Number': 'Plur'}], [0, 2]), None),
+    ((None, {'Number': 'Plur'}, 0), 'BAD_REQUEST'),
+    (('Ich habe das rote Auto gesehen.', {'Case': 'Dat'}, 2), None),
+    ((123, {'Number': 'Plur'}, 0), 'BAD_REQUEST'),
+    (('Der Hund läuft.', {'Number': 'Plur'}, '1'), 'BAD_REQUEST'),
+    (('Die Kinder spielen im Kindergarten.', {'Tense': 'Past'}, 2), None),
+    (('Der Hund läuft.', {'Number': 'Plur'}, 1.0), 'BAD_REQUEST'),
+    (('Der Hund läuft.', {'Number': 'Plur'}, 10), 'INDEX_OUT_OF_RANGE'),
+    (('Meine Mutter liest ein gutes Buch.', [{'Case': 'Dat'}, {'Case': 'Dat'}], [0, 1]), None),
+    (('Der Hund läuft.', [{'Number': 'Plur'}, {'Number': 'Plur'}], [1]), 'ARGS_MISMATCH'),
+    (('Der Hund läuft.', {'Number': ['Plur']}, 1), 'ERROR'),
+    (('Der schnelle Hund läuft über die Straße.', {'Tense': 'Past'}, 3), None)
+]
+
+
+class StructuredTest:
+
+    def __init__(self, derbi, stream: list=stream):
+        self.derbi = derbi
+        self.stream = stream
+
+    def __call__(self, batch_size: int=4) -> dict:
+        expected = [self.derbi(*request, structured=True).as_dict() if status is None else status
+                    for request, status in self.stream]
+        results = list(self.derbi.pipe([request for request, _ in self.stream], batch_size=batch_size, structured=True))
+        report = {'results': len(results) == len(self.stream), 'mismatches': []}
+        for (request, status), result, exp in zip(self.stream, results, expected):
+            got = result.as_dict() if status is None else result.status.name
+            if got != exp:
+                report['mismatches'].append((request, got, exp))
+        return report
+
+
+def main(model_name: str='de_core_news_sm'):
+    from DERBI.derbi import DERBI
+    derbi = DERBI(spacy.load(model_name))
+    report = StructuredTest(derbi)()
+    print(report)
+    assert report['results'] and not len(report['mismatches'])
+
+if __name__ == '__main__':
+    main()
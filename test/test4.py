@@ -0,0 +1,91 @@
+import spacy
+
+# import requred packages
+# we will ignore warnings
+import warnings
+warnings.simplefilter('ignore')
+
+'''
+Participle test.
+spaCy tags the participles used as adjectives as ADJ, and DERBI redirects
+them to the verb inflector if their lemmas are verbs. DERBI decides it without
+the model when it can (see DERBI.participle_lemma); the results must be the same
+as if the model was asked for every lemma. We inflect all the ADJ tokens
+of the texts (participles and plain adjectives) both ways and compare.
+'''
+
+texts = [
+    'Die gebackenen Brötchen schmecken gut.',
+    'Das geliebte Kind schläft im Garten.',
+    'Der laufende Motor ist sehr laut.',
+    'Die begonnene Arbeit ist schwer.',
+    'Die verlorenen Schlüssel liegen dort.',
+    'Das gegessene Brot war alt.',
+    'Die spielenden Kinder lachen laut.',
+    'Ein geschriebener Brief liegt auf dem Tisch.',
+    'Die angekommenen Gäste warten vor der Tür.',
+    'Das gestohlene Auto wurde gefunden.',
+    'Der erfahrene Lehrer hilft den neuen Schülern.',
+    'Die bekannte Sängerin singt ein trauriges Lied.',
+    'Das offene Fenster ist in dem kleinen Zimmer.',
+    'Die verschiedenen Farben sind schön.'
+]
+
+target_tagsets = [{'Case': 'Dat'}, {'Number': 'Plur'}, {'Case': 'Gen', 'Number': 'Plur'}]
+
+
+# DERBI that asks the model for every lemma, as it did before the participles were decided without it
+def model_participle_lemma(derbi):
+    def participle_lemma(lemma: str, text: str=None):
+        lemma_token = derbi.model(lemma)[0]
+        return lemma_token if lemma_token.pos_ == 'VERB' else None
+    return participle_lemma
+
+
+class ParticipleTest:
+
+    def __init__(self, derbi, model_derbi, texts: list=texts, target_tagsets: list=target_tagsets):
+        self.derbi = derbi
+        self.model_derbi = model_derbi
+        self.texts = texts
+        self.target_tagsets = target_tagsets
+
+    # we compare the results and the types of the exceptions
+    @staticmethod
+    def call(derbi, request: tuple) -> str:
+        try:
+            return derbi(*request)
+        except Exception as e:
+            return type(e).__name__
+
+    def __call__(self) -> dict:
+        report = {'adj_tokens': 0, 'redirected': 0, 'mismatches': []}
+        for doc in self.derbi.model.pipe(self.texts):
+            for token in doc:
+                if token.pos_ != 'ADJ':
+                    continue
+                report['adj_tokens'] += 1
+                fast = self.derbi.participle_lemma(token.lemma_, token.text) is not None
+                report['redirected'] += fast
+                if fast != (self.model_derbi.participle_lemma(token.lemma_, token.text) is not None):
+                    report['mismatches'].append((token.text, token.lemma_))
+                    continue
+                for target_tags in self.target_tagsets:
+                    result = self.call(self.derbi, (doc, target_tags, token.i))
+                    expected = self.call(self.model_derbi, (doc, target_tags, token.i))
+                    if result != expected:
+                        report['mismatches'].append((token.text, target_tags, result, expected))
+        return report
+
+
+def main(model_name: str='de_core_news_sm'):
+    from DERBI.derbi import DERBI
+    nlp = spacy.load(model_name)
+    derbi, model_derbi = DERBI(nlp), DERBI(nlp)
+    model_derbi.participle_lemma = model_participle_lemma(model_derbi)
+    report = ParticipleTest(derbi, model_derbi)()
+    print(report)
+    assert not len(report['mismatches'])
+
+if __name__ == '__main__':
+    main()